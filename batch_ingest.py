@@ -0,0 +1,263 @@
+import os
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Tuple, Optional, Iterable
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+# Size of the byte ranges that are parsed in parallel
+DEFAULT_CHUNK_BYTES = 32 * 1024 * 1024
+
+
+class BatchIngestResult:
+    """Batch output lines separated into successes, errors, truncations and malformed lines."""
+
+    def __init__(self):
+        # custom_id -> message content (chat completions) or embedding (embeddings)
+        self.successes: Dict[str, Any] = {}
+        # custom_id -> error description
+        self.errors: Dict[str, str] = {}
+        # custom_id -> truncated message content (finish_reason == "length")
+        self.truncated: Dict[str, Any] = {}
+        # (file path, byte offset, error description) of lines that could not be parsed
+        self.malformed: List[Tuple[str, int, str]] = []
+
+    def update(self, other: "BatchIngestResult"):
+        """Merge the results of another chunk into this one."""
+        self.successes.update(other.successes)
+        self.errors.update(other.errors)
+        self.truncated.update(other.truncated)
+        self.malformed.extend(other.malformed)
+
+    def failed_ids(self) -> set:
+        """custom_ids that should be retried: errors and truncations."""
+        return (set(self.errors) | set(self.truncated)) - set(self.successes)
+
+    def summary(self) -> str:
+        """One-line count of each category."""
+        return (f"{len(self.successes)} succeeded, {len(self.errors)} failed, "
+                f"{len(self.truncated)} truncated, {len(self.malformed)} malformed lines")
+
+
+def classify_entry(entry: Dict) -> Tuple[str, Any]:
+    """
+    Classify one parsed batch output line.
+
+    Returns:
+        Tuple[str, Any]: ("success" | "truncated", payload) or ("error", description)
+    """
+    if entry.get("error"):
+        return "error", str(entry["error"])
+    response = entry.get("response") or {}
+    status_code = response.get("status_code")
+    if status_code != 200:
+        return "error", f"status_code {status_code}"
+    body = response.get("body") or {}
+    try:
+        if "choices" in body:
+            choice = body["choices"][0]
+            content = choice["message"]["content"]
+            if choice.get("finish_reason") == "length":
+                return "truncated", content
+            if content is None:
+                return "error", f"empty content (finish_reason {choice.get('finish_reason')})"
+            return "success", content
+        return "success", body["data"][0]["embedding"]
+    except (KeyError, IndexError, TypeError) as e:
+        return "error", f"unexpected response body: {e!r}"
+
+
+def parse_range(file_path: str, start: int, end: int) -> BatchIngestResult:
+    """Parse the batch output lines in the byte range [start, end) of a file."""
+    result = BatchIngestResult()
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+
+    offset = start
+    for line in data.split(b'\n'):
+        line_offset = offset
+        offset += len(line) + 1
+        if not line.strip():
+            continue
+        try:
+            entry = _loads(line)
+        except ValueError as e:
+            result.malformed.append((file_path, line_offset, str(e)))
+            continue
+        custom_id = entry.get("custom_id") if isinstance(entry, dict) else None
+        if not custom_id:
+            result.malformed.append((file_path, line_offset, "missing custom_id"))
+            continue
+        status, payload = classify_entry(entry)
+        if status == "success":
+            result.successes[custom_id] = payload
+        elif status == "truncated":
+            result.truncated[custom_id] = payload
+        else:
+            result.errors[custom_id] = payload
+    return result
+
+
+def split_ranges(file_path: str, chunk_bytes: int = DEFAULT_CHUNK_BYTES) -> List[Tuple[str, int, int]]:
+    """Split a file into byte ranges of about chunk_bytes that end on line boundaries."""
+    size = os.path.getsize(file_path)
+    ranges = []
+    start = 0
+    with open(file_path, 'rb') as f:
+        while start < size:
+            end = min(start + chunk_bytes, size)
+            if end < size:
+                f.seek(end)
+                f.readline()
+                end = f.tell()
+            ranges.append((file_path, start, end))
+            start = end
+    return ranges
+
+
+def _parse_range_args(args: Tuple[str, int, int]) -> BatchIngestResult:
+    return parse_range(*args)
+
+
+def ingest_batch_output(file_paths: Iterable[str], workers: Optional[int] = None,
+                        chunk_bytes: int = DEFAULT_CHUNK_BYTES) -> BatchIngestResult:
+    """
+    Parse batch output files in parallel byte ranges and classify every line.
+
+    Args:
+        file_paths: Batch output JSONL files
+        workers: Number of worker processes (default: number of CPUs; 1 parses in-process)
+        chunk_bytes: Approximate size of the byte range parsed by one task
+
+    Returns:
+        BatchIngestResult: Successes, errors, truncations and malformed lines of all files
+    """
+    ranges = [r for file_path in file_paths for r in split_ranges(file_path, chunk_bytes)]
+    result = BatchIngestResult()
+    if len(ranges) <= 1 or workers == 1:
+        for r in ranges:
+            result.update(parse_range(*r))
+        return result
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for chunk_result in executor.map(_parse_range_args, ranges):
+            result.update(chunk_result)
+    return result
+
+
+def load_request_ids(requests_files: List[str]) -> List[str]:
+    """Read the custom_ids of batch requests files."""
+    request_ids = []
+    for requests_file in requests_files:
+        with open(requests_file, 'rb') as f:
+            request_ids.extend(_loads(line)["custom_id"] for line in f if line.strip())
+    return request_ids
+
+
+def coverage_report(result: BatchIngestResult, request_ids: List[str]) -> Dict[str, Any]:
+    """Compare the batch output against the requests that were submitted."""
+    requested = set(request_ids)
+    received = set(result.successes) | set(result.errors) | set(result.truncated)
+    succeeded = set(result.successes) & requested
+    return {
+        "requested": len(requested),
+        "succeeded": len(succeeded),
+        "failed": len(set(result.errors) & requested - succeeded),
+        "truncated": len(set(result.truncated) & requested - succeeded),
+        "missing": sorted(requested - received),
+        "unexpected": sorted(received - requested),
+        "coverage": len(succeeded) / len(requested) if requested else 1.0,
+    }
+
+
+def retry_ids(result: BatchIngestResult, request_ids: Optional[List[str]] = None) -> set:
+    """custom_ids to retry: failed and truncated lines, plus requests without any output line."""
+    ids = result.failed_ids()
+    if request_ids is not None:
+        received = set(result.successes) | set(result.errors) | set(result.truncated)
+        ids |= set(request_ids) - received
+    return ids
+
+
+def write_retry_file(requests_files: List[str], failed_ids: set, output_file: str,
+                     truncated_ids: Optional[set] = None, max_tokens_factor: float = 2.0) -> int:
+    """
+    Write the original requests of the failed custom_ids to a new batch file.
+
+    Requests that were truncated get their max_tokens raised by max_tokens_factor,
+    so they do not hit the same limit again.
+
+    Returns:
+        int: Number of requests written
+    """
+    truncated_ids = truncated_ids or set()
+    count = 0
+    with open(output_file, 'w', encoding='utf-8') as dst:
+        for requests_file in requests_files:
+            with open(requests_file, 'r', encoding='utf-8') as src:
+                for line in src:
+                    if not line.strip():
+                        continue
+                    request = json.loads(line)
+                    custom_id = request.get("custom_id")
+                    if custom_id not in failed_ids:
+                        continue
+                    body = request.get("body", {})
+                    if custom_id in truncated_ids and "max_tokens" in body:
+                        body["max_tokens"] = int(body["max_tokens"] * max_tokens_factor)
+                        dst.write(json.dumps(request, ensure_ascii=False) + '\n')
+                    else:
+                        dst.write(line if line.endswith('\n') else line + '\n')
+                    count += 1
+    return count
+
+
+def ingest_and_report(batch_output_files: List[str], requests_files: Optional[List[str]] = None,
+                      retry_file: Optional[str] = None, workers: Optional[int] = None) -> BatchIngestResult:
+    """
+    Ingest batch output files, print a summary and coverage, and optionally write a retry file.
+
+    Used by the merge scripts before they update the text chunk files.
+    """
+    result = ingest_batch_output(batch_output_files, workers)
+    print(f"Batch output: {result.summary()}")
+    for file_path, offset, error in result.malformed[:10]:
+        print(f"Malformed line in {file_path} at byte {offset}: {error}")
+    for custom_id, error in list(result.errors.items())[:10]:
+        print(f"Failed request {custom_id}: {error}")
+
+    request_ids = None
+    if requests_files:
+        request_ids = load_request_ids(requests_files)
+        report = coverage_report(result, request_ids)
+        print(f"Coverage: {report['succeeded']}/{report['requested']} requests succeeded "
+              f"({report['coverage']:.1%}), {len(report['missing'])} missing, "
+              f"{len(report['unexpected'])} unexpected custom_ids")
+
+    if retry_file:
+        if not requests_files:
+            raise ValueError("A requests file is needed to write a retry file.")
+        failed = retry_ids(result, request_ids)
+        count = write_retry_file(requests_files, failed, retry_file, set(result.truncated))
+        print(f"Wrote {count} requests to retry to {retry_file}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate batch output files, report coverage and write a retry file for failed requests.")
+    parser.add_argument("--batch_output_files", nargs='+', required=True, help="Batch output JSONL files.")
+    parser.add_argument("--requests_files", nargs='+', help="Batch requests JSONL files that were submitted, for coverage and retries.")
+    parser.add_argument("--retry_file", help="Path to write the requests of failed, truncated and missing custom_ids.")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: number of CPUs).")
+    args = parser.parse_args()
+
+    ingest_and_report(args.batch_output_files, args.requests_files, args.retry_file, args.workers)
+
+
+if __name__ == "__main__":
+    main()
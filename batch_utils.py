@@ -0,0 +1,84 @@
+import os
+import json
+from typing import Iterable, Iterator, List, Dict, Any, Tuple, Optional
+
+# OpenAI Batch API limits for a single input file
+MAX_REQUESTS_PER_BATCH = 50000
+MAX_BYTES_PER_BATCH = 200 * 1024 * 1024
+
+# Separator between the report name and the element ID in a corpus custom_id
+CUSTOM_ID_SEPARATOR = "::"
+
+
+def make_custom_id(report_name: str, element_id: str) -> str:
+    """Encode the source report and the element ID into a single custom_id."""
+    return f"{report_name}{CUSTOM_ID_SEPARATOR}{element_id}"
+
+
+def split_custom_id(custom_id: str) -> Tuple[Optional[str], str]:
+    """
+    Split a custom_id into (report_name, element_id).
+
+    Custom IDs written by the single-report mode contain only the element ID,
+    in which case the report name is None.
+    """
+    if CUSTOM_ID_SEPARATOR not in custom_id:
+        return None, custom_id
+    report_name, element_id = custom_id.rsplit(CUSTOM_ID_SEPARATOR, 1)
+    return report_name, element_id
+
+
+def report_name_from_path(file_path: str) -> str:
+    """Use the file name without extension as the report name."""
+    return os.path.splitext(os.path.basename(file_path))[0]
+
+
+def pack_batch_lines(requests: Iterable[Dict[str, Any]],
+                     max_requests: int = MAX_REQUESTS_PER_BATCH,
+                     max_bytes: int = MAX_BYTES_PER_BATCH) -> Iterator[List[str]]:
+    """
+    Serialize requests and pack them greedily into as few batches as the limits allow.
+
+    Args:
+        requests: Iterable of batch request dictionaries
+        max_requests: Maximum number of requests per batch file
+        max_bytes: Maximum size of a batch file in bytes
+
+    Yields:
+        List[str]: Serialized JSONL lines for one batch file
+    """
+    lines = []
+    size = 0
+    for request in requests:
+        line = json.dumps(request, ensure_ascii=False) + '\n'
+        line_size = len(line.encode('utf-8'))
+        if line_size > max_bytes:
+            raise ValueError(f"Request {request.get('custom_id')} is larger than the batch size limit.")
+        if lines and (len(lines) >= max_requests or size + line_size > max_bytes):
+            yield lines
+            lines = []
+            size = 0
+        lines.append(line)
+        size += line_size
+    if lines:
+        yield lines
+
+
+def write_batch_files(requests: Iterable[Dict[str, Any]], output_folder: str, prefix: str,
+                      max_requests: int = MAX_REQUESTS_PER_BATCH,
+                      max_bytes: int = MAX_BYTES_PER_BATCH) -> List[str]:
+    """
+    Write requests into numbered JSONL batch files.
+
+    Returns:
+        List[str]: Paths of the written batch files
+    """
+    os.makedirs(output_folder, exist_ok=True)
+    output_files = []
+    for batch_number, lines in enumerate(pack_batch_lines(requests, max_requests, max_bytes), start=1):
+        output_file = os.path.join(output_folder, f"{prefix}_{batch_number:03d}.jsonl")
+        with open(output_file, 'w', encoding='utf-8') as f:
+            f.writelines(lines)
+        print(f"Saved batch file with {len(lines)} requests: {output_file}")
+        output_files.append(output_file)
+    return output_files
@@ -0,0 +1,241 @@
+import os
+import json
+import hashlib
+import argparse
+import logging
+from itertools import product
+from typing import List, Dict, Tuple, Optional
+import numpy as np
+from unstructured.staging.base import elements_from_json
+from semantic_chunking import chunk_elements_by_title, partition_cache_suffix
+from local_search import LocalIndex
+from quantize_embeddings import QuantizedEmbeddings, embed_queries, load_query_embeddings
+from rerank import count_tokens
+from tcfd_queries import TCFD_QUERIES
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+
+EMBEDDING_MODEL = "text-embedding-3-small"
+# USD per million input tokens for text-embedding-3-small
+EMBEDDING_PRICE_PER_MILLION_TOKENS = 0.02
+
+
+class EmbeddingCache:
+    """Embed texts with the OpenAI API, caching embeddings by content hash in a JSONL file."""
+
+    def __init__(self, cache_path: Optional[str] = None, model: str = EMBEDDING_MODEL, batch_size: int = 256):
+        self.cache_path = cache_path
+        self.model = model
+        self.batch_size = batch_size
+        self.cache = {}
+        self.client = None
+        if cache_path and os.path.exists(cache_path):
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    entry = json.loads(line)
+                    self.cache[entry["key"]] = entry["embedding"]
+
+    def key(self, text: str) -> str:
+        """Cache key of a text for the embedding model."""
+        return hashlib.sha256(f"{self.model}\x00{text}".encode("utf-8")).hexdigest()
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Embed texts, calling the API only for texts that are not cached yet."""
+        keys = [self.key(text) for text in texts]
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in self.cache and key not in missing:
+                missing[key] = text.replace("\n", " ") or " "
+        if missing:
+            if self.client is None:
+                from openai import OpenAI
+                self.client = OpenAI()
+            missing_keys = list(missing)
+            new_entries = []
+            for i in range(0, len(missing_keys), self.batch_size):
+                batch_keys = missing_keys[i:i + self.batch_size]
+                response = self.client.embeddings.create(input=[missing[key] for key in batch_keys], model=self.model)
+                for key, item in zip(batch_keys, response.data):
+                    self.cache[key] = item.embedding
+                    new_entries.append(key)
+            if self.cache_path:
+                with open(self.cache_path, 'a', encoding='utf-8') as f:
+                    for key in new_entries:
+                        f.write(json.dumps({"key": key, "embedding": self.cache[key]}) + '\n')
+        return np.asarray([self.cache[key] for key in keys], dtype=np.float32)
+
+
+def load_partitions(partition_cache_dir: str, suffix: str = "_partition.json") -> Dict[str, list]:
+    """
+    Load cached partitions written by semantic_chunking.py, keyed by the PDF filename.
+
+    suffix selects the partitions made with one set of options (see
+    semantic_chunking.partition_cache_suffix). Two cached partitions of the same PDF
+    raise a ValueError instead of one silently replacing the other.
+    """
+    partitions = {}
+    sources = {}
+    for file_name in sorted(os.listdir(partition_cache_dir)):
+        if not file_name.endswith(suffix):
+            continue
+        elements = elements_from_json(filename=os.path.join(partition_cache_dir, file_name))
+        if not elements:
+            continue
+        pdf_name = elements[0].metadata.filename or file_name
+        if pdf_name in partitions:
+            raise ValueError(f"Several cached partitions of {pdf_name}: {sources[pdf_name]} and {file_name}. "
+                             "Select one set of partitioning options.")
+        partitions[pdf_name] = elements
+        sources[pdf_name] = file_name
+    return partitions
+
+
+def chunk_pages(chunk) -> set:
+    """Pages covered by a chunk, including all pages of its original elements."""
+    pages = {el.metadata.page_number for el in (chunk.metadata.orig_elements or [])}
+    pages.add(chunk.metadata.page_number)
+    pages.discard(None)
+    return pages
+
+
+def settings_grid(max_characters: List[int], new_after_n_chars: List[int]) -> List[Tuple[int, int]]:
+    """All (max_characters, new_after_n_chars) pairs with a soft maximum below the hard maximum."""
+    return [(hard, soft) for hard, soft in product(max_characters, new_after_n_chars) if soft <= hard]
+
+
+def evaluate_setting(partitions: Dict[str, list], relevance: Dict[str, Dict[str, List[int]]],
+                     max_characters: int, new_after_n_chars: int, embedder: EmbeddingCache,
+                     query_vectors: np.ndarray, k_values: List[int],
+                     token_budgets: Optional[List[int]] = None) -> Dict:
+    """
+    Re-chunk all reports with one setting, index them locally and measure recall@k.
+
+    A chunk counts as a hit for a query if it covers one of the labelled relevant pages.
+    recall@k is the fraction of relevant pages covered by the top-k chunks, averaged over
+    all labelled (report, query) pairs. Since larger chunks cover more pages at the same k,
+    recall is also measured at equal context-token budgets: the best chunks are taken in
+    rank order while their total tokens stay within the budget.
+    """
+    token_budgets = token_budgets or []
+    chunk_count = 0
+    token_count = 0
+    recalls = {k: [] for k in k_values}
+    budget_recalls = {budget: [] for budget in token_budgets}
+    context_tokens = []
+
+    for filename, elements in partitions.items():
+        chunks = chunk_elements_by_title(elements, max_characters, new_after_n_chars)
+        texts = [chunk.text for chunk in chunks]
+        chunk_tokens = {chunk.id: count_tokens(chunk.text) for chunk in chunks}
+        chunk_count += len(chunks)
+        token_count += sum(chunk_tokens.values())
+
+        labels = relevance.get(filename)
+        if not labels or not chunks:
+            continue
+
+        vectors = embedder.embed(texts)
+        ids = [chunk.id for chunk in chunks]
+        elements_for_index = [
+            {"element_id": chunk.id, "text": chunk.text,
+             "metadata": {"filename": filename, "page_number": chunk.metadata.page_number}}
+            for chunk in chunks
+        ]
+        index = LocalIndex(elements_for_index, QuantizedEmbeddings(ids, "none", vectors.shape[1], vectors))
+        pages_by_id = {chunk.id: chunk_pages(chunk) for chunk in chunks}
+
+        for query_name, query_vector in zip(TCFD_QUERIES, query_vectors):
+            relevant = set(labels.get(query_name, []))
+            if not relevant:
+                continue
+            docs = index.search(query_vector, len(chunks) if token_budgets else max(k_values))
+            for k in k_values:
+                covered = set().union(*(pages_by_id[doc["id"]] for doc in docs[:k]))
+                recalls[k].append(len(covered & relevant) / len(relevant))
+            context_tokens.append(sum(chunk_tokens[doc["id"]] for doc in docs[:max(k_values)]))
+            for budget in token_budgets:
+                covered = set()
+                used = 0
+                for doc in docs:
+                    used += chunk_tokens[doc["id"]]
+                    if used > budget:
+                        break
+                    covered |= pages_by_id[doc["id"]]
+                budget_recalls[budget].append(len(covered & relevant) / len(relevant))
+
+    return {
+        "max_characters": max_characters,
+        "new_after_n_chars": new_after_n_chars,
+        "chunks": chunk_count,
+        "tokens": token_count,
+        "embedding_cost_usd": token_count / 1e6 * EMBEDDING_PRICE_PER_MILLION_TOKENS,
+        "recall": {k: float(np.mean(values)) if values else None for k, values in recalls.items()},
+        "recall_at_budget": {budget: float(np.mean(values)) if values else None
+                             for budget, values in budget_recalls.items()},
+        "mean_context_tokens": float(np.mean(context_tokens)) if context_tokens else None,
+        "labelled_queries": len(context_tokens),
+    }
+
+
+def print_results(results: List[Dict], k_values: List[int], token_budgets: Optional[List[int]] = None):
+    """Print one row per setting: recall@k and recall at each token budget against chunk count and token cost."""
+    token_budgets = token_budgets or []
+    header = (["max_chars", "new_after", "chunks", "tokens", "cost_usd"] + [f"recall@{k}" for k in k_values]
+              + ["ctx_tokens"] + [f"recall@{budget}tok" for budget in token_budgets])
+    print("\t".join(header))
+    for r in results:
+        recall = [f"{r['recall'][k]:.3f}" if r['recall'][k] is not None else "-" for k in k_values]
+        context = f"{r['mean_context_tokens']:.0f}" if r['mean_context_tokens'] is not None else "-"
+        budget_recall = [f"{r['recall_at_budget'][b]:.3f}" if r['recall_at_budget'][b] is not None else "-"
+                         for b in token_budgets]
+        print("\t".join([str(r["max_characters"]), str(r["new_after_n_chars"]), str(r["chunks"]),
+                         str(r["tokens"]), f"{r['embedding_cost_usd']:.4f}"] + recall + [context] + budget_recall))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tune chunk sizes by re-chunking cached partitions and measuring retrieval recall against cost.")
+    parser.add_argument("--partition_cache_dir", required=True, help="Directory of cached partitions (semantic_chunking.py --partition_cache_dir).")
+    parser.add_argument("--languages", nargs="*", default=["eng"], help="Languages the partitions were made with. Default is ['eng'].")
+    parser.add_argument("--strategy", default="hi_res", help="Strategy the partitions were made with. Default is 'hi_res'.")
+    parser.add_argument("--infer_table_structure", type=bool, default=True, help="Whether the partitions inferred table structure. Default is True.")
+    parser.add_argument("--extract_element_types", nargs="*", default=['Table'], help="Element types the partitions extracted. Default is ['Table'].")
+    parser.add_argument("--hi_res_model_name", default="yolox", help="Model name the partitions were made with. Default is 'yolox'.")
+    parser.add_argument("--relevance_file", required=True, help='JSON file of relevant pages per report and query: {"<PDF filename>": {"tcfd_01": [12, 13], ...}}.')
+    parser.add_argument("--max_characters", type=int, nargs='+', default=[1000, 1500, 2000, 3000], help="Hard maximum chunk sizes to try.")
+    parser.add_argument("--new_after_n_chars", type=int, nargs='+', default=[500, 1000, 1500], help="Soft maximum chunk sizes to try.")
+    parser.add_argument("--k", type=int, nargs='+', default=[5, 10, 20], help="Values of k for recall@k (default: 5 10 20).")
+    parser.add_argument("--token_budget", type=int, nargs='*', default=[1000, 2000, 4000], help="Context-token budgets for recall at equal context size, which compares chunk sizes fairly (default: 1000 2000 4000).")
+    parser.add_argument("--embedding_cache", default=None, help="JSONL file to cache chunk embeddings between runs.")
+    parser.add_argument("--query_embeddings", help="JSON file mapping TCFD query names to embeddings. If omitted, the queries are embedded with the OpenAI API.")
+    parser.add_argument("--output_file", help="Optional path to save the results as JSON.")
+    args = parser.parse_args()
+
+    with open(args.relevance_file, 'r', encoding='utf-8') as f:
+        relevance = json.load(f)
+    suffix = partition_cache_suffix(args.strategy, args.infer_table_structure, args.extract_element_types,
+                                    args.languages, args.hi_res_model_name)
+    partitions = load_partitions(args.partition_cache_dir, suffix)
+    logging.info(f"Loaded cached partitions of {len(partitions)} reports")
+
+    if args.query_embeddings:
+        query_vectors = load_query_embeddings(args.query_embeddings, TCFD_QUERIES)
+    else:
+        query_vectors = embed_queries(TCFD_QUERIES)
+
+    embedder = EmbeddingCache(args.embedding_cache)
+    k_values = sorted(args.k)
+    token_budgets = sorted(args.token_budget)
+    results = []
+    for max_characters, new_after_n_chars in settings_grid(args.max_characters, args.new_after_n_chars):
+        logging.info(f"Evaluating max_characters={max_characters}, new_after_n_chars={new_after_n_chars}")
+        results.append(evaluate_setting(partitions, relevance, max_characters, new_after_n_chars,
+                                        embedder, query_vectors, k_values, token_budgets))
+
+    print_results(results, k_values, token_budgets)
+    if args.output_file:
+        with open(args.output_file, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
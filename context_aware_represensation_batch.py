@@ -2,8 +2,10 @@
 import os
 import json
 import argparse
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Optional
 from dotenv import load_dotenv
+from batch_utils import (MAX_REQUESTS_PER_BATCH, MAX_BYTES_PER_BATCH, make_custom_id,
+                         report_name_from_path, write_batch_files)
 
 # Load environment variables
 load_dotenv()
@@ -131,6 +133,41 @@ def get_context(elements, current_element):
     
     return "\n".join(context)
 
+def iter_table_requests(input_data: List[Dict], max_tokens: int = 1700,
+                        report_name: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Yield one batch request per table element.
+
+    Args:
+        input_data: List of document elements
+        max_tokens: Maximum tokens for the API
+        report_name: If given, encode the report name into the custom_id (corpus mode)
+    """
+    for element in input_data:
+        if element.get('type') == 'Table' and 'metadata' in element:
+            # Get element ID
+            element_id = element.get('element_id')
+            if not element_id:
+                continue
+            try:
+                # Get html table format
+                html_table = element['metadata']['text_as_html']
+
+                table_content_text = element['text']
+                
+                # Get context
+                context = get_context(input_data, element)
+                
+                # Create prompt
+                prompt = create_prompt(html_table, table_content_text, context)
+                
+                custom_id = make_custom_id(report_name, element_id) if report_name else element_id
+                yield create_batch_request(custom_id, prompt, max_tokens)
+                
+            except Exception as e:
+                print(f"Error processing table {element_id}: {str(e)}")
+                continue
+
 def create_batch_file(input_data: List[Dict], output_file: str, max_tokens: int = 1700) -> None:
     """
     Create a JSONL batch file for processing tables.
@@ -141,44 +178,14 @@ def create_batch_file(input_data: List[Dict], output_file: str, max_tokens: int
     """
     try:
         print(f"Creating batch file: {output_file}")
-        batch_requests = []
-        table_count = 0
-        
-        # Process each element
-        for element in input_data:
-            if element.get('type') == 'Table' and 'metadata' in element:
-                try:
-                    # Get element ID
-                    element_id = element.get('element_id')
-                    if not element_id:
-                        continue
-                    
-                    # Get html table format
-                    html_table = element['metadata']['text_as_html']
-
-                    table_content_text = element['text']
-                    
-                    # Get context
-                    context = get_context(input_data, element)
-                    
-                    # Create prompt
-                    prompt = create_prompt(html_table, table_content_text, context)
-                    
-                    # Create batch request
-                    batch_request = create_batch_request(element_id, prompt, max_tokens)
-                    batch_requests.append(batch_request)
-                    table_count += 1
-                    
-                except Exception as e:
-                    print(f"Error processing table {element_id}: {str(e)}")
-                    continue
+        batch_requests = list(iter_table_requests(input_data, max_tokens))
         
         # Write batch requests to JSONL file
         with open(output_file, 'w', encoding='utf-8') as f:
             for request in batch_requests:
                 f.write(json.dumps(request, ensure_ascii=False) + '\n')
         
-        print(f"Successfully created batch file with {table_count} requests")
+        print(f"Successfully created batch file with {len(batch_requests)} requests")
         
     except Exception as e:
         print(f"Error creating batch file: {str(e)}")
@@ -210,6 +217,42 @@ def process_folder(input_folder: str, output_folder: str, max_tokens: int = 1700
             output_file = os.path.join(output_folder, f"{os.path.splitext(file_name)[0]}_markdown_requests.jsonl")
             process_file(input_file, output_file, max_tokens)
 
+def iter_corpus_requests(input_folder: str, max_tokens: int = 1700) -> Iterator[Dict[str, Any]]:
+    """Yield table requests from every JSON file in a folder, one report at a time."""
+    for file_name in sorted(os.listdir(input_folder)):
+        if not file_name.endswith(".json"):
+            continue
+        input_file = os.path.join(input_folder, file_name)
+        try:
+            with open(input_file, 'r', encoding='utf-8') as f:
+                input_data = json.load(f)
+        except Exception as e:
+            print(f"Error processing file {input_file}: {str(e)}")
+            continue
+
+        report_name = report_name_from_path(input_file)
+        table_count = 0
+        for request in iter_table_requests(input_data, max_tokens, report_name):
+            table_count += 1
+            yield request
+        print(f"Collected {table_count} requests from {input_file}")
+
+def process_corpus(input_folder: str, output_folder: str, max_tokens: int = 1700,
+                   max_requests: int = MAX_REQUESTS_PER_BATCH,
+                   max_bytes: int = MAX_BYTES_PER_BATCH) -> List[str]:
+    """
+    Pack table requests from all reports in a folder into as few batch files as the limits allow.
+
+    Each custom_id has the form "<report name>::<element_id>", so the batch output can be
+    routed back to the right chunk file with merge_context_aware_representation.py --corpus.
+
+    Returns:
+        List[str]: Paths of the written batch files
+    """
+    print(f"Processing corpus in folder: {input_folder}")
+    requests = iter_corpus_requests(input_folder, max_tokens)
+    return write_batch_files(requests, output_folder, "corpus_markdown_requests", max_requests, max_bytes)
+
 def main(input_path: str, output_folder: str, max_tokens: int = 1700) -> None:
     """
     Main function to process a file or folder.
@@ -235,6 +278,15 @@ if __name__ == "__main__":
     parser.add_argument("--input_path", required=True, help="Input file or folder path (JSON file or folder containing JSON files).")
     parser.add_argument("--output_folder", required=True, help="Output folder for batch files.")
     parser.add_argument("--max_tokens", type=int, default=1700, help="Maximum tokens for GPT (default: 1700).")
+    parser.add_argument("--corpus", action="store_true", help="Pack requests from all reports in the input folder into as few batch files as possible.")
+    parser.add_argument("--max_requests_per_batch", type=int, default=MAX_REQUESTS_PER_BATCH, help=f"Maximum requests per batch file in corpus mode (default: {MAX_REQUESTS_PER_BATCH}).")
+    parser.add_argument("--max_bytes_per_batch", type=int, default=MAX_BYTES_PER_BATCH, help=f"Maximum size of a batch file in bytes in corpus mode (default: {MAX_BYTES_PER_BATCH}).")
     
     args = parser.parse_args()
-    main(args.input_path, args.output_folder, args.max_tokens)
+    if args.corpus:
+        if not os.path.isdir(args.input_path):
+            parser.error("--corpus requires --input_path to be a folder.")
+        process_corpus(args.input_path, args.output_folder, args.max_tokens,
+                       args.max_requests_per_batch, args.max_bytes_per_batch)
+    else:
+        main(args.input_path, args.output_folder, args.max_tokens)
@@ -0,0 +1,292 @@
+import os
+import json
+import mmap
+import struct
+import argparse
+from typing import List, Dict, Optional, Iterable, Iterator, Tuple
+import numpy as np
+from pinecone_formatter import parse_filename
+
+DATA_FILE = "data.bin"
+INDEX_FILE = "index.jsonl"
+
+_HEADER_LENGTH = struct.Struct("<I")
+
+
+class CorpusStore:
+    """
+    Append-only store of text chunks, metadata and embeddings for all reports.
+
+    The store is a directory with two files:
+        data.bin     records of [uint32 header length][JSON header][float32 embedding]
+        index.jsonl  one line per record: element_id, offset, length, report, corporate, year
+
+    The index is loaded into memory on open, giving O(1) lookup by element_id and
+    ordered scans per report or per (corporate, year). Records are read through a
+    memory map of data.bin, and embeddings are returned as zero-copy float32 views.
+    Writing an element that already exists appends a new record that supersedes the
+    old one; compact() rewrites the store without superseded records.
+    A store supports one writer at a time. After a crash during a write, the torn end of
+    the index is dropped on open, so only the elements of that write are lost.
+    """
+
+    def __init__(self, path: str):
+        """Open the store at path, creating it if needed."""
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.data_path = os.path.join(path, DATA_FILE)
+        self.index_path = os.path.join(path, INDEX_FILE)
+        self._map = None
+        self._mapped_size = 0
+        for file_path in (self.data_path, self.index_path):
+            if not os.path.exists(file_path):
+                open(file_path, 'wb').close()
+        self._load_index()
+
+    def _load_index(self):
+        # element_id -> index entry
+        self.entries: Dict[str, Dict] = {}
+        # report -> element IDs / (corporate, year) -> element IDs, in insertion order
+        self.by_report: Dict[Optional[str], Dict[str, None]] = {}
+        self.by_entity: Dict[Tuple[Optional[str], Optional[int]], Dict[str, None]] = {}
+        data_size = os.path.getsize(self.data_path)
+        with open(self.index_path, 'rb') as f:
+            content = f.read()
+
+        # (byte offset, entry) per line; entry is None for a torn line or a record beyond data.bin
+        lines = []
+        offset = 0
+        for line in content.split(b'\n'):
+            if line.strip():
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    entry = None
+                if entry is not None and entry["offset"] + entry["length"] > data_size:
+                    entry = None
+                lines.append((offset, entry))
+            offset += len(line) + 1
+
+        # A crash during put_many can leave a torn last line, or lines whose records never
+        # reached data.bin. Drop that tail, like the orphaned bytes at the end of data.bin.
+        valid = len(lines)
+        while valid and lines[valid - 1][1] is None:
+            valid -= 1
+        if any(entry is None for _, entry in lines[:valid]):
+            raise ValueError(f"Corrupt line in {self.index_path}")
+        for _, entry in lines[:valid]:
+            self._add_entry(entry)
+        if valid < len(lines):
+            with open(self.index_path, 'r+b') as f:
+                f.truncate(lines[valid][0])
+        elif content and not content.endswith(b'\n'):
+            # the last entry is complete but lost its newline
+            with open(self.index_path, 'ab') as f:
+                f.write(b'\n')
+
+    def _add_entry(self, entry: Dict):
+        element_id = entry["id"]
+        previous = self.entries.get(element_id)
+        if previous is not None:
+            self.by_report.get(previous["report"], {}).pop(element_id, None)
+            self.by_entity.get((previous["corporate"], previous["year"]), {}).pop(element_id, None)
+        self.entries[element_id] = entry
+        self.by_report.setdefault(entry["report"], {})[element_id] = None
+        self.by_entity.setdefault((entry["corporate"], entry["year"]), {})[element_id] = None
+
+    def _data(self):
+        """Memory map of data.bin, re-mapped when the file has grown."""
+        size = os.path.getsize(self.data_path)
+        if self._map is None or size > self._mapped_size:
+            with open(self.data_path, 'rb') as f:
+                # Views into an old map keep it alive until they are released
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mapped_size = size
+        return self._map
+
+    def put_many(self, elements: Iterable[Dict], report: Optional[str] = None) -> int:
+        """
+        Append elements to the store.
+
+        Args:
+            elements: Text chunk elements with element_id, text, metadata and optionally embedding
+            report: Report name used for per-report scans, e.g. the chunk file name
+
+        Returns:
+            int: Number of elements written
+        """
+        count = 0
+        with open(self.data_path, 'ab') as data_file, open(self.index_path, 'a', encoding='utf-8') as index_file:
+            offset = data_file.seek(0, os.SEEK_END)
+            for element in elements:
+                record = {key: value for key, value in element.items() if key != "embedding"}
+                embedding = element.get("embedding")
+                vector = np.asarray(embedding, dtype="<f4") if embedding is not None else np.empty(0, dtype="<f4")
+                record["dim"] = len(vector)
+                header = json.dumps(record, ensure_ascii=False).encode("utf-8")
+                payload = _HEADER_LENGTH.pack(len(header)) + header + vector.tobytes()
+                data_file.write(payload)
+
+                corporate, year = parse_filename(element.get("metadata", {}).get("filename", ""))
+                entry = {"id": element["element_id"], "offset": offset, "length": len(payload),
+                         "report": report, "corporate": corporate, "year": year}
+                index_file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+                self._add_entry(entry)
+                offset += len(payload)
+                count += 1
+        return count
+
+    def put(self, element: Dict, report: Optional[str] = None):
+        """Append a single element."""
+        self.put_many([element], report)
+
+    def update_many(self, updates: Dict[str, Dict]) -> int:
+        """
+        Set fields of existing elements, keeping their report.
+
+        Args:
+            updates: element_id -> fields to set, e.g. {"text": ...} or {"embedding": [...]}
+
+        Returns:
+            int: Number of elements updated; IDs that are not in the store are skipped
+        """
+        by_report: Dict[Optional[str], List[Dict]] = {}
+        for element_id, fields in updates.items():
+            element = self.get(element_id)
+            if element is None:
+                continue
+            element.update(fields)
+            by_report.setdefault(self.entries[element_id]["report"], []).append(element)
+        return sum(self.put_many(elements, report) for report, elements in by_report.items())
+
+    def _read(self, entry: Dict) -> Dict:
+        data = self._data()
+        offset = entry["offset"]
+        (header_length,) = _HEADER_LENGTH.unpack_from(data, offset)
+        start = offset + _HEADER_LENGTH.size
+        element = json.loads(data[start:start + header_length])
+        dim = element.pop("dim")
+        if dim:
+            element["embedding"] = np.frombuffer(data, dtype="<f4", count=dim, offset=start + header_length)
+        return element
+
+    def get(self, element_id: str) -> Optional[Dict]:
+        """
+        Look up an element by ID.
+
+        Returns:
+            Optional[Dict]: The element, with the embedding as a read-only float32 array, or None
+        """
+        entry = self.entries.get(element_id)
+        return self._read(entry) if entry is not None else None
+
+    def get_text(self, element_id: str) -> Optional[str]:
+        """Text of an element, or None if it is not in the store."""
+        element = self.get(element_id)
+        return element.get("text") if element is not None else None
+
+    def __contains__(self, element_id: str) -> bool:
+        return element_id in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def reports(self) -> List[str]:
+        """Names of all reports in the store."""
+        return [report for report, ids in self.by_report.items() if ids and report is not None]
+
+    def scan(self, corporate: Optional[str] = None, year: Optional[int] = None,
+             report: Optional[str] = None) -> Iterator[Dict]:
+        """
+        Yield elements in insertion order, optionally restricted to a report or to a corporate and year.
+        """
+        if report is not None:
+            ids = list(self.by_report.get(report, {}))
+        elif corporate is not None or year is not None:
+            ids = [
+                element_id
+                for (entity_corporate, entity_year), entity_ids in self.by_entity.items()
+                if (corporate is None or entity_corporate == corporate) and (year is None or entity_year == year)
+                for element_id in entity_ids
+            ]
+        else:
+            ids = list(self.entries)
+        for element_id in ids:
+            yield self._read(self.entries[element_id])
+
+    def to_json_elements(self, report: str) -> List[Dict]:
+        """Elements of a report in the format of the per-report JSON files (embeddings as lists)."""
+        elements = []
+        for element in self.scan(report=report):
+            if "embedding" in element:
+                element["embedding"] = element["embedding"].tolist()
+            elements.append(element)
+        return elements
+
+    def compact(self):
+        """Rewrite the store without superseded records."""
+        compacted_path = self.path.rstrip(os.sep) + ".compacting"
+        compacted = CorpusStore(compacted_path)
+        for report, ids in self.by_report.items():
+            compacted.put_many((self._read(self.entries[element_id]) for element_id in ids), report)
+        compacted.close()
+        self.close()
+        os.replace(compacted.data_path, self.data_path)
+        os.replace(compacted.index_path, self.index_path)
+        os.rmdir(compacted_path)
+        self._load_index()
+
+    def close(self):
+        """Drop the memory map."""
+        self._map = None
+        self._mapped_size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def import_json_files(store_path: str, json_files: List[str]) -> int:
+    """Import per-report JSON files into a store, using the file name as report name."""
+    total = 0
+    with CorpusStore(store_path) as store:
+        for json_file in json_files:
+            with open(json_file, 'r', encoding='utf-8') as f:
+                elements = json.load(f)
+            report = os.path.splitext(os.path.basename(json_file))[0]
+            count = store.put_many(elements, report)
+            print(f"Imported {count} elements from {json_file} as report {report}")
+            total += count
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the corpus store of text chunks, metadata and embeddings.")
+    parser.add_argument("--store", required=True, help="Path to the corpus store directory.")
+    parser.add_argument("--import_files", nargs='+', help="Per-report JSON files to import into the store.")
+    parser.add_argument("--get", nargs='+', help="Print the text of these element IDs.")
+    parser.add_argument("--export_report", help="Export the elements of a report to JSON (requires --output_file).")
+    parser.add_argument("--output_file", help="Output JSON file for --export_report.")
+    parser.add_argument("--compact", action="store_true", help="Rewrite the store without superseded records.")
+    args = parser.parse_args()
+
+    if args.import_files:
+        import_json_files(args.store, args.import_files)
+    with CorpusStore(args.store) as store:
+        if args.get:
+            for element_id in args.get:
+                print(json.dumps({"element_id": element_id, "text": store.get_text(element_id)}, ensure_ascii=False))
+        if args.export_report:
+            if not args.output_file:
+                parser.error("--export_report requires --output_file.")
+            with open(args.output_file, 'w', encoding='utf-8') as f:
+                json.dump(store.to_json_elements(args.export_report), f, indent=4, ensure_ascii=False)
+        if args.compact:
+            store.compact()
+        print(f"Store {args.store}: {len(store)} elements in {len(store.reports())} reports")
+
+
+if __name__ == "__main__":
+    main()
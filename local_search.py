@@ -0,0 +1,128 @@
+import json
+import argparse
+from typing import List, Dict, Optional
+import numpy as np
+from pinecone_formatter import parse_filename
+from quantize_embeddings import QuantizedEmbeddings, embed_queries
+
+
+class LocalIndex:
+    """
+    In-memory exact search over text chunks, without Pinecone.
+
+    Works with full-precision embeddings from merged JSON files or with reduced
+    embeddings saved by quantize_embeddings.py.
+    """
+
+    def __init__(self, elements: List[Dict], embeddings: QuantizedEmbeddings):
+        """
+        Args:
+            elements: Text chunk elements, aligned with embeddings.ids
+            embeddings: Stored (possibly reduced) embeddings
+        """
+        self.elements = elements
+        self.embeddings = embeddings
+        entities = [
+            parse_filename(element.get("metadata", {}).get("filename", "")) for element in elements
+        ]
+        self.corporates = np.array([corporate or "" for corporate, _ in entities])
+        self.years = np.array([year or 0 for _, year in entities])
+
+    @classmethod
+    def from_elements(cls, elements: List[Dict], embeddings_path: Optional[str] = None) -> "LocalIndex":
+        """
+        Build an index from text chunk elements.
+
+        If embeddings_path is given, the reduced embeddings from that .npz file are
+        used for the elements they cover, and the elements only provide text and metadata.
+        """
+        if embeddings_path:
+            embeddings = QuantizedEmbeddings.load(embeddings_path)
+            by_id = {element["element_id"]: element for element in elements}
+            # The .npz may cover more reports than the given elements; keep only the rows of these elements
+            rows = [row for row, element_id in enumerate(embeddings.ids) if element_id in by_id]
+            ids = [embeddings.ids[row] for row in rows]
+            embeddings = QuantizedEmbeddings(ids, embeddings.method, embeddings.dim, embeddings.codes[rows],
+                                             embeddings.scale, embeddings.codebooks)
+            elements = [by_id[element_id] for element_id in ids]
+        else:
+            elements = [element for element in elements if "embedding" in element]
+            vectors = np.asarray([element["embedding"] for element in elements], dtype=np.float32)
+            embeddings = QuantizedEmbeddings([element["element_id"] for element in elements],
+                                             "none", vectors.shape[1] if len(vectors) else 0, vectors)
+        return cls(elements, embeddings)
+
+    @classmethod
+    def from_files(cls, chunk_files: List[str], embeddings_path: Optional[str] = None) -> "LocalIndex":
+        """Build an index from merged JSON files."""
+        elements = []
+        for chunk_file in chunk_files:
+            with open(chunk_file, 'r', encoding='utf-8') as f:
+                elements.extend(json.load(f))
+        return cls.from_elements(elements, embeddings_path)
+
+    @classmethod
+    def from_store(cls, store_path: str, corporate: Optional[str] = None, year: Optional[int] = None,
+                   embeddings_path: Optional[str] = None) -> "LocalIndex":
+        """Build an index from the elements of a corpus store, optionally for one corporate and/or year."""
+        from corpus_store import CorpusStore
+
+        with CorpusStore(store_path) as store:
+            elements = list(store.scan(corporate=corporate, year=year))
+        return cls.from_elements(elements, embeddings_path)
+
+    def search(self, query_embedding, top_k: int = 20, corporate: Optional[str] = None,
+               year: Optional[int] = None) -> List[Dict]:
+        """
+        Return the top_k chunks for a query embedding, optionally filtered by corporate and year.
+
+        Returns:
+            List[Dict]: Documents with id, score, text and page_number, best first
+        """
+        scores = self.embeddings.scores(np.asarray(query_embedding, dtype=np.float32))
+        mask = np.ones(len(scores), dtype=bool)
+        if corporate is not None:
+            mask &= self.corporates == corporate
+        if year is not None:
+            mask &= self.years == year
+        candidates = np.flatnonzero(mask)
+        if not len(candidates):
+            return []
+        top_k = min(top_k, len(candidates))
+        best = candidates[np.argpartition(-scores[candidates], top_k - 1)[:top_k]]
+        best = best[np.argsort(-scores[best])]
+        return [
+            {
+                "id": self.elements[i]["element_id"],
+                "score": float(scores[i]),
+                "text": self.elements[i]["text"],
+                "page_number": self.elements[i]["metadata"].get("page_number", "N/A"),
+            }
+            for i in best
+        ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Semantic search over local text chunk files with full-precision or reduced embeddings.")
+    parser.add_argument("--chunk_files", nargs='+', help="Merged JSON files with text chunks (and embeddings if --embeddings is not given).")
+    parser.add_argument("--store", help="Corpus store to search instead of --chunk_files.")
+    parser.add_argument("--embeddings", help="Reduced embeddings (.npz) from quantize_embeddings.py.")
+    parser.add_argument("--query", required=True, help="Query text.")
+    parser.add_argument("--top_k", type=int, default=20, help="Number of results (default: 20).")
+    parser.add_argument("--corporate", help="Filter by corporate name.")
+    parser.add_argument("--year", type=int, help="Filter by report year.")
+    args = parser.parse_args()
+
+    if args.store:
+        index = LocalIndex.from_store(args.store, args.corporate, args.year, args.embeddings)
+    elif args.chunk_files:
+        index = LocalIndex.from_files(args.chunk_files, args.embeddings)
+    else:
+        parser.error("Provide --chunk_files or --store.")
+    query_embedding = embed_queries({"query": args.query})[0]
+    for doc in index.search(query_embedding, args.top_k, args.corporate, args.year):
+        print(json.dumps(doc, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,60 @@
+import os
 import json
 import argparse
+from collections import defaultdict
+from batch_utils import split_custom_id, report_name_from_path
+from batch_ingest import ingest_and_report
+from corpus_store import CorpusStore
 
-def update_init_chunk(jsonl_file_path, json_file_path, output_file_path):
+def update_init_chunk(jsonl_file_path, json_file_path, output_file_path, requests_file=None, retry_file=None,
+                      store_path=None):
     """
     Updates a JSON file by incorporating context-aware content from the JSONL batch output file.
 
+    Failed, truncated and malformed batch lines are reported and left out of the merge.
+
     Args:
         jsonl_file_path (str): Path to the batch output file with content to add.
         json_file_path (str): Path to the initial text chunk file to be updated.
         output_file_path (str): Path to save the updated JSON file.
+        requests_file (str): Optional path to the submitted batch requests file, to report coverage.
+        retry_file (str): Optional path to write the requests that need to be retried.
+        store_path (str): Optional corpus store to write to. Without json_file_path, the
+                          elements are updated in the store directly.
     """
     # Step 1: Read the batch output file and extract content
-    custom_id_to_content = {}
     try:
-        with open(jsonl_file_path, 'r') as jsonl_file:
-            for line in jsonl_file:
-                entry = json.loads(line)
-                custom_id = entry.get('custom_id')
-                content = entry['response']['body']['choices'][0]['message']['content']
-                if custom_id:
-                    custom_id_to_content[custom_id] = content
-    except FileNotFoundError:
-        print(f"Error: File {jsonl_file_path} not found.")
-        return
-    except json.JSONDecodeError as e:
-        print(f"Error decoding JSONL file: {e}")
+        result = ingest_and_report([jsonl_file_path], [requests_file] if requests_file else None, retry_file)
+    except FileNotFoundError as e:
+        print(f"Error: File {e.filename} not found.")
         return
+    custom_id_to_content = result.successes
 
     # Step 2: Read the JSON file, update it, and save
+    if json_file_path:
+        write_updated_chunk(custom_id_to_content, json_file_path, output_file_path, store_path)
+    else:
+        update_store(custom_id_to_content, store_path)
+
+def update_store(element_id_to_content, store_path):
+    """Replace the text of matching elements directly in the corpus store."""
+    with CorpusStore(store_path) as store:
+        updated_count = store.update_many({element_id: {"text": content}
+                                           for element_id, content in element_id_to_content.items()})
+    print(f"Successfully updated corpus store {store_path}")
+    print(f"Number of elements updated: {updated_count}")
+
+def write_updated_chunk(element_id_to_content, json_file_path, output_file_path, store_path=None):
+    """
+    Replace the text of matching elements in a text chunk file and save the result.
+
+    Args:
+        element_id_to_content (dict): Mapping from element ID to context-aware content.
+        json_file_path (str): Path to the initial text chunk file to be updated.
+        output_file_path (str): Path to save the updated JSON file, or None to only write to the store.
+        store_path (str): Optional corpus store to write the updated elements to, under the
+                          name of the initial text chunk file.
+    """
     try:
         with open(json_file_path, 'r') as json_file:
             elements = json.load(json_file)
@@ -35,30 +62,99 @@ def update_init_chunk(jsonl_file_path, json_file_path, output_file_path):
         updated_count = 0
         for element in elements:
             element_id = element.get('element_id')
-            if element_id in custom_id_to_content:
+            if element_id in element_id_to_content:
                 # Add the content as a new key 'text'
-                element['text'] = custom_id_to_content[element_id]
+                element['text'] = element_id_to_content[element_id]
                 updated_count += 1
 
         # Write the updated elements back to the output JSON file
-        with open(output_file_path, 'w', encoding='utf-8') as json_file:
-            json.dump(elements, json_file, indent=4, ensure_ascii=False)
-
-        print(f"Successfully updated initial text chunk file and saved to {output_file_path}")
+        if output_file_path:
+            with open(output_file_path, 'w', encoding='utf-8') as json_file:
+                json.dump(elements, json_file, indent=4, ensure_ascii=False)
+            print(f"Successfully updated initial text chunk file and saved to {output_file_path}")
+        if store_path:
+            with CorpusStore(store_path) as store:
+                store.put_many(elements, report_name_from_path(json_file_path))
+            print(f"Successfully updated initial text chunk file and saved to corpus store {store_path}")
         print(f"Number of elements updated: {updated_count}")
     except FileNotFoundError:
         print(f"Error: File {json_file_path} not found.")
     except json.JSONDecodeError as e:
         print(f"Error decoding JSON file: {e}")
 
+def merge_corpus(batch_output_files, init_chunk_folder, output_folder, requests_files=None, retry_file=None,
+                 store_path=None):
+    """
+    Route every line of corpus batch output files back into the right text chunk file.
+
+    The batch output lines are streamed once and grouped by the report name encoded in
+    their custom_id ("<report name>::<element_id>"). Each text chunk file
+    "<report name>.json" in init_chunk_folder is then updated and saved as
+    "<report name>_updated.json" in output_folder.
+
+    Args:
+        batch_output_files (list): Paths to the corpus batch output files.
+        init_chunk_folder (str): Folder containing the initial text chunk files.
+        output_folder (str): Folder to save the updated text chunk files.
+        requests_files (list): Optional paths to the submitted corpus batch files, to report coverage.
+        retry_file (str): Optional path to write the requests that need to be retried.
+        store_path (str): Optional corpus store to write to. Without init_chunk_folder, the
+                          elements are updated in the store directly.
+    """
+    # Step 1: Parse all batch output lines and group the successful content per report
+    try:
+        result = ingest_and_report(batch_output_files, requests_files, retry_file)
+    except FileNotFoundError as e:
+        print(f"Error: File {e.filename} not found.")
+        return
+
+    report_to_content = defaultdict(dict)
+    for custom_id, content in result.successes.items():
+        report_name, element_id = split_custom_id(custom_id)
+        if report_name is None:
+            print(f"Skipping custom_id without report name: {custom_id}")
+            continue
+        report_to_content[report_name][element_id] = content
+
+    # Step 2: Update each referenced text chunk file once
+    if not init_chunk_folder:
+        update_store({element_id: content for contents in report_to_content.values()
+                      for element_id, content in contents.items()}, store_path)
+        return
+    if output_folder:
+        os.makedirs(output_folder, exist_ok=True)
+    for report_name, element_id_to_content in report_to_content.items():
+        json_file_path = os.path.join(init_chunk_folder, f"{report_name}.json")
+        output_file_path = os.path.join(output_folder, f"{report_name}_updated.json") if output_folder else None
+        write_updated_chunk(element_id_to_content, json_file_path, output_file_path, store_path)
+
 def main():
     parser = argparse.ArgumentParser(description="Process and update initial text chunk file with context-aware content from batch output.")
-    parser.add_argument("--batch_output_file", required=True, help="Path to the context-aware batch output file.")
-    parser.add_argument("--init_text_chunk_file", required=True, help="Path to the initial text chunk file to be updated.")
-    parser.add_argument("--output_file", required=True, help="Path to save the updated text chunk file.")
+    parser.add_argument("--batch_output_file", required=True, nargs='+', help="Path to the context-aware batch output file (several files in corpus mode).")
+    parser.add_argument("--init_text_chunk_file", help="Path to the initial text chunk file to be updated.")
+    parser.add_argument("--output_file", help="Path to save the updated text chunk file.")
+    parser.add_argument("--corpus", action="store_true", help="Route corpus batch output back to every report in --init_text_chunk_folder.")
+    parser.add_argument("--init_text_chunk_folder", help="Folder containing the initial text chunk files (corpus mode).")
+    parser.add_argument("--output_folder", help="Folder to save the updated text chunk files (corpus mode).")
+    parser.add_argument("--requests_file", nargs='+', help="Submitted batch requests file(s), to report coverage of the batch output.")
+    parser.add_argument("--retry_file", help="Path to write the requests of failed, truncated and missing custom_ids (requires --requests_file).")
+    parser.add_argument("--store", help="Corpus store to write the updated elements to. Without initial text chunk files, the elements already in the store are updated.")
     args = parser.parse_args()
+    if args.retry_file and not args.requests_file:
+        parser.error("--retry_file requires --requests_file.")
 
-    update_init_chunk(args.batch_output_file, args.init_text_chunk_file, args.output_file)
+    if args.corpus:
+        if not args.store and (not args.init_text_chunk_folder or not args.output_folder):
+            parser.error("--corpus requires --init_text_chunk_folder and --output_folder, or --store.")
+        merge_corpus(args.batch_output_file, args.init_text_chunk_folder, args.output_folder,
+                     args.requests_file, args.retry_file, args.store)
+    else:
+        if len(args.batch_output_file) != 1 or (
+                not args.store and (not args.init_text_chunk_file or not args.output_file)):
+            parser.error("Provide one --batch_output_file with --init_text_chunk_file and --output_file (or --store), or use --corpus.")
+        requests_file = args.requests_file[0] if args.requests_file else None
+        update_init_chunk(args.batch_output_file[0], args.init_text_chunk_file, args.output_file,
+                          requests_file, args.retry_file, args.store)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,17 +1,22 @@
 import json
 import argparse
+from batch_ingest import ingest_and_report
+from batch_utils import report_name_from_path
+from corpus_store import CorpusStore
 
-def merge_embeddings(jsonl_file_path, json_file_path, output_file_path):
-    # Step 1: Read the JSONL file and extract content
-    custom_id_to_content = {}
-    with open(jsonl_file_path, 'r', encoding='utf-8') as jsonl_file:
-        for line in jsonl_file:
-            entry = json.loads(line)
-            custom_id = entry.get('custom_id')
-            content = entry['response']['body']['data'][0]['embedding']
-            
-            # Store the content using custom_id as the key
-            custom_id_to_content[custom_id] = content
+def merge_embeddings(jsonl_file_path, json_file_path, output_file_path, requests_file=None, retry_file=None,
+                     store_path=None):
+    # Step 1: Read the JSONL file and extract the embeddings of successful requests
+    result = ingest_and_report([jsonl_file_path], [requests_file] if requests_file else None, retry_file)
+    custom_id_to_content = result.successes
+
+    # With a corpus store and no text chunk file, add the embeddings to the stored elements
+    if store_path and not json_file_path:
+        with CorpusStore(store_path) as store:
+            updated_count = store.update_many({custom_id: {"embedding": embedding}
+                                               for custom_id, embedding in custom_id_to_content.items()})
+        print(f"Added {updated_count} embeddings to corpus store {store_path}")
+        return
 
     # Step 2: Read the second JSON file, update it, and save
     with open(json_file_path, 'r', encoding='utf-8') as json_file:
@@ -26,15 +31,27 @@ def merge_embeddings(jsonl_file_path, json_file_path, output_file_path):
                 element['embedding'] = custom_id_to_content[element_id]
 
     # Write the updated elements back to the output JSON file
-    with open(output_file_path, 'w', encoding='utf-8') as json_file:
-        json.dump(elements, json_file, indent=4)
+    if output_file_path:
+        with open(output_file_path, 'w', encoding='utf-8') as json_file:
+            json.dump(elements, json_file, indent=4)
+    if store_path:
+        with CorpusStore(store_path) as store:
+            store.put_many(elements, report_name_from_path(json_file_path))
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Merge embeddings from a JSONL file into a JSON file.")
     parser.add_argument("--input_embedding", required=True, help="Path to the input JSONL file containing embeddings.")
-    parser.add_argument("--input_text_chunk", required=True, help="Path to the input JSON file containing context-aware text chunks.")
-    parser.add_argument("--output", required=True, help="Path to the output JSON file to save merged data.")
+    parser.add_argument("--input_text_chunk", help="Path to the input JSON file containing context-aware text chunks.")
+    parser.add_argument("--output", help="Path to the output JSON file to save merged data.")
+    parser.add_argument("--requests_file", help="Path to the submitted embedding requests file, to report coverage of the batch output.")
+    parser.add_argument("--retry_file", help="Path to write the requests of failed and missing custom_ids (requires --requests_file).")
+    parser.add_argument("--store", help="Corpus store to write the merged elements to. Without --input_text_chunk, the embeddings are added to the elements already in the store.")
     
     args = parser.parse_args()
+    if args.retry_file and not args.requests_file:
+        parser.error("--retry_file requires --requests_file.")
+    if not args.store and (not args.input_text_chunk or not args.output):
+        parser.error("Provide --input_text_chunk and --output, or --store.")
     
-    merge_embeddings(args.input_embedding, args.input_text_chunk, args.output)
\ No newline at end of file
+    merge_embeddings(args.input_embedding, args.input_text_chunk, args.output, args.requests_file, args.retry_file,
+                     args.store)
\ No newline at end of file
@@ -1,20 +1,48 @@
+import os
 import json
 import re
 import argparse
 import logging
-from typing import List, Dict, Optional
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from functools import lru_cache
+from typing import List, Dict, Optional, Tuple, Iterator
+import numpy as np
+from quantize_embeddings import QuantizedEmbeddings
 
 logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
 
+CORPORATE_PATTERN = re.compile(r"^([A-Za-z]+)")
+YEAR_PATTERN = re.compile(r"_(\d{4})\.pdf$")
+
+
+@lru_cache(maxsize=None)
+def parse_filename(file_name: str) -> Tuple[Optional[str], Optional[int]]:
+    """Extract the corporate name and report year from a report filename."""
+    corporate_match = CORPORATE_PATTERN.match(file_name)
+    corporate_name = corporate_match.group(1) if corporate_match else None
+    year_match = YEAR_PATTERN.search(file_name)
+    year = int(year_match.group(1)) if year_match else None
+    return corporate_name, year
+
+
 class PineconeFormatter:
     """A class to format JSON data for Pinecone by extracting metadata from filenames."""
 
-    def __init__(self, input_path: str, output_path: str):
-        """Initialize the formatter with input and output file paths."""
+    def __init__(self, input_path: str, output_path: str, embeddings_path: Optional[str] = None):
+        """
+        Initialize the formatter with input and output file paths.
+
+        If embeddings_path points to reduced embeddings from quantize_embeddings.py, the
+        vector values are taken from there (decoded to float32) instead of the input file.
+        """
         self.input_path = input_path
         self.output_path = output_path
-        self.corporate_pattern = re.compile(r"^([A-Za-z]+)")
-        self.year_pattern = re.compile(r"_(\d{4})\.pdf$")
+        self.reduced_rows = None
+        self.reduced_vectors = None
+        if embeddings_path:
+            self.reduced_rows, self.reduced_vectors = load_reduced_embeddings(embeddings_path)
 
     def load_json(self) -> List[Dict]:
         """Load JSON data from the input file."""
@@ -31,38 +59,71 @@ class PineconeFormatter:
             logging.error(f"An error occurred while loading the file: {e}")
             raise
 
-    def process_data(self, data: List[Dict]) -> List[Dict]:
-        """Process the data to extract corporate names and years from filenames."""
-        formatted_data = []
-        
+    def build_metadata(self, item: Dict) -> Dict:
+        """Build the Pinecone metadata for one item, adding corporate name and year."""
+        file_name = item["metadata"].get("filename", "")
+        corporate_name, year = parse_filename(file_name)
+
+        metadata = {
+            "file_name": file_name,
+            "text": item["text"],
+            "page_number": item["metadata"].get("page_number", 0),
+        }
+
+        if corporate_name and year:
+            metadata["corporate"] = corporate_name
+            metadata["year"] = year
+
+        return metadata
+
+    def valid_items(self, data: List[Dict]) -> Iterator[Dict]:
+        """Yield the items that have all keys required by Pinecone."""
         for item in data:
-            if not all(key in item for key in ["metadata", "element_id", "embedding", "text"]):
-                logging.warning(f"Skipping item due to missing required keys: {item}")
+            if not all(key in item for key in ["metadata", "element_id", "text"]):
+                logging.warning(f"Skipping item due to missing required keys: {item.get('element_id')}")
+                continue
+            if self.reduced_rows is None:
+                if "embedding" not in item:
+                    logging.warning(f"Skipping item due to missing embedding: {item['element_id']}")
+                    continue
+            elif item["element_id"] not in self.reduced_rows:
+                logging.warning(f"Skipping item without reduced embedding: {item['element_id']}")
                 continue
+            yield item
 
-            file_name = item["metadata"].get("filename", "")
-            corporate_match = self.corporate_pattern.match(file_name)
-            corporate_name = corporate_match.group(1) if corporate_match else None
-            year_match = self.year_pattern.search(file_name)
-            year = int(year_match.group(1)) if year_match else None
-            
-            metadata = {
-                "file_name": file_name,
-                "text": item["text"],
-                "page_number": item["metadata"].get("page_number", 0),
-            }
-            
-            if corporate_name and year:
-                metadata["corporate"] = corporate_name
-                metadata["year"] = year
-            
-            formatted_data.append({
+    def item_values(self, item: Dict, as_list: bool = False):
+        """Embedding of an item, from the reduced embeddings if given."""
+        if self.reduced_rows is None:
+            return item["embedding"]
+        values = self.reduced_vectors[self.reduced_rows[item["element_id"]]]
+        return values.tolist() if as_list else values
+
+    def process_data(self, data: List[Dict]) -> List[Dict]:
+        """Process the data to extract corporate names and years from filenames."""
+        return [
+            {
                 "id": item["element_id"],
-                "values": item["embedding"],
-                "metadata": metadata,
-            })
-        
-        return formatted_data
+                "values": self.item_values(item, as_list=True),
+                "metadata": self.build_metadata(item),
+            }
+            for item in self.valid_items(data)
+        ]
+
+    def process_arrays(self, data: List[Dict]) -> Tuple[List[str], np.ndarray, List[Dict]]:
+        """
+        Process the data into IDs, a float32 embedding matrix and metadata.
+
+        The embeddings of all items are converted into one array at once instead
+        of being copied item by item.
+        """
+        items = list(self.valid_items(data))
+        ids = [item["element_id"] for item in items]
+        metadata = [self.build_metadata(item) for item in items]
+        if items:
+            vectors = np.asarray([self.item_values(item) for item in items], dtype=np.float32)
+        else:
+            vectors = np.empty((0, 0), dtype=np.float32)
+        return ids, vectors, metadata
 
     def save_json(self, data: List[Dict]):
         """Save the processed data to the output file."""
@@ -73,19 +134,253 @@ class PineconeFormatter:
             logging.error(f"An error occurred while saving the file: {e}")
             raise
 
+    def save_npz(self, ids: List[str], vectors: np.ndarray, metadata: List[Dict]):
+        """Save the processed data to the output file in the compact binary format."""
+        try:
+            save_vectors_npz(self.output_path, ids, vectors, metadata)
+        except Exception as e:
+            logging.error(f"An error occurred while saving the file: {e}")
+            raise
+
     def run(self):
         """Run the formatter: load, process, and save data."""
         data = self.load_json()
-        processed_data = self.process_data(data)
-        self.save_json(processed_data)
-        logging.info(f"Processed {len(processed_data)} vectors and saved to {self.output_path}")
+        if self.output_path.endswith(".npz"):
+            ids, vectors, metadata = self.process_arrays(data)
+            self.save_npz(ids, vectors, metadata)
+            count = len(ids)
+        else:
+            processed_data = self.process_data(data)
+            self.save_json(processed_data)
+            count = len(processed_data)
+        logging.info(f"Processed {count} vectors and saved to {self.output_path}")
+
+
+def load_reduced_embeddings(embeddings_path: str) -> Tuple[Dict[str, int], np.ndarray]:
+    """Load reduced embeddings and decode them to float32, with a row index by element ID."""
+    reduced = QuantizedEmbeddings.load(embeddings_path)
+    rows = {element_id: row for row, element_id in enumerate(reduced.ids)}
+    return rows, reduced.decode()
+
+
+def save_vectors_npz(output_path: str, ids: List[str], vectors: np.ndarray, metadata: List[Dict]):
+    """
+    Save vectors in the compact binary format.
+
+    The file holds the IDs, a float32 matrix of embeddings and the metadata as one
+    UTF-8 blob of JSON documents with their end offsets. A fixed-width string array
+    would pad every chunk text to the longest one.
+    """
+    encoded = [json.dumps(m, ensure_ascii=False).encode("utf-8") for m in metadata]
+    np.savez(
+        output_path,
+        ids=np.array(ids, dtype=str),
+        values=vectors.astype(np.float32, copy=False),
+        metadata_blob=np.frombuffer(b"".join(encoded), dtype=np.uint8),
+        metadata_offsets=np.cumsum([len(m) for m in encoded], dtype=np.int64),
+    )
+
+
+def load_vectors_npz(input_path: str) -> Tuple[List[str], np.ndarray, List[Dict]]:
+    """Load IDs, embeddings and metadata saved by save_vectors_npz."""
+    with np.load(input_path) as data:
+        ids = data["ids"].tolist()
+        vectors = data["values"]
+        if "metadata_blob" in data:
+            blob = data["metadata_blob"].tobytes()
+            ends = data["metadata_offsets"].tolist()
+            metadata = [json.loads(blob[start:end]) for start, end in zip([0] + ends[:-1], ends)]
+        else:
+            # files written before the metadata blob
+            metadata = [json.loads(m) for m in data["metadata"].tolist()]
+    return ids, vectors, metadata
+
+
+def iter_vector_batches(ids: List[str], vectors: np.ndarray, metadata: List[Dict],
+                        batch_size: int = 300) -> Iterator[List[Dict]]:
+    """Yield Pinecone upsert payloads of at most batch_size vectors."""
+    for i in range(0, len(ids), batch_size):
+        values = vectors[i:i + batch_size].tolist()
+        yield [
+            {"id": vector_id, "values": vector_values, "metadata": vector_metadata}
+            for vector_id, vector_values, vector_metadata
+            in zip(ids[i:i + batch_size], values, metadata[i:i + batch_size])
+        ]
+
+
+def _format_file(input_path: str, output_path: Optional[str], reduced_mode: bool = False):
+    """
+    Format a single merged file in a worker process.
+
+    If output_path is given, the result is written there and only the vector count is
+    returned. Otherwise the arrays are returned so the parent process can upsert them.
+    In reduced mode, the worker only parses the file and returns its items without the
+    full-precision embeddings; the parent takes the vectors from the reduced embeddings.
+    """
+    formatter = PineconeFormatter(input_path, output_path or "")
+    data = formatter.load_json()
+    if reduced_mode:
+        items = [{key: value for key, value in item.items() if key != "embedding"} for item in data]
+        return input_path, len(items), items
+    ids, vectors, metadata = formatter.process_arrays(data)
+    if output_path:
+        formatter.save_npz(ids, vectors, metadata)
+        return input_path, len(ids), None
+    return input_path, len(ids), (ids, vectors, metadata)
+
+
+def format_directory(input_dir: str, output_dir: Optional[str] = None, index=None,
+                     workers: Optional[int] = None, batch_size: int = 300,
+                     embeddings_path: Optional[str] = None) -> int:
+    """
+    Format all merged JSON files in a directory with a process pool.
+
+    Either writes one .npz file per input file to output_dir, or upserts the
+    formatted vectors directly into the given Pinecone index in batches, so that no
+    intermediate JSON file is written. At most two files per worker are in flight, so
+    the parent never holds more formatted files than it can upsert.
+
+    Args:
+        input_dir: Directory containing merged JSON files with embeddings
+        output_dir: Directory for the .npz output files
+        index: Pinecone index to upsert into instead of writing files
+        workers: Number of worker processes (default: number of CPUs)
+        batch_size: Number of vectors per upsert request
+        embeddings_path: Optional reduced embeddings (.npz) from quantize_embeddings.py
+
+    Returns:
+        int: Total number of formatted vectors
+    """
+    if (output_dir is None) == (index is None):
+        raise ValueError("Provide exactly one of output_dir or index.")
+
+    input_files = sorted(
+        os.path.join(input_dir, f) for f in os.listdir(input_dir) if f.endswith(".json")
+    )
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+        output_files = [
+            os.path.join(output_dir, f"{os.path.splitext(os.path.basename(f))[0]}_pinecone.npz")
+            for f in input_files
+        ]
+    else:
+        output_files = [None] * len(input_files)
+
+    # Load and decode the reduced embeddings once; the parent looks up the rows of each
+    # file, so the decoded matrix is never copied into the workers
+    reduced_formatter = PineconeFormatter("", "", embeddings_path) if embeddings_path else None
+
+    workers = workers or os.cpu_count() or 1
+    # Bounded submit window: results waiting for upsert are held by the parent
+    window = 2 * workers
+
+    total = 0
+    reduced_mode = reduced_formatter is not None
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        tasks = iter(zip(input_files, output_files))
+        for input_path, output_path in islice(tasks, window):
+            pending.append((output_path, executor.submit(_format_file, input_path, output_path, reduced_mode)))
+        while pending:
+            output_path, future = pending.popleft()
+            input_path, count, arrays = future.result()
+            for next_input, next_output in islice(tasks, 1):
+                pending.append((next_output, executor.submit(_format_file, next_input, next_output, reduced_mode)))
+            if reduced_mode:
+                arrays = reduced_formatter.process_arrays(arrays)
+                count = len(arrays[0])
+                if output_path:
+                    save_vectors_npz(output_path, *arrays)
+                    arrays = None
+            total += count
+            if arrays is not None:
+                for batch in iter_vector_batches(*arrays, batch_size=batch_size):
+                    index.upsert(vectors=batch)
+                logging.info(f"Upserted {count} vectors from {input_path}")
+            else:
+                logging.info(f"Formatted {count} vectors from {input_path}")
+
+    logging.info(f"Processed {total} vectors from {len(input_files)} files")
+    return total
+
+
+def format_store(store_path: str, output_dir: Optional[str] = None, index=None, batch_size: int = 300,
+                 embeddings_path: Optional[str] = None, corporate: Optional[str] = None,
+                 year: Optional[int] = None) -> int:
+    """
+    Format the elements of a corpus store, one report at a time.
+
+    Reads elements and their memory-mapped embeddings from the store instead of
+    per-report JSON files, and writes one .npz file per report to output_dir or upserts
+    the vectors directly into the Pinecone index. With corporate and/or year, only
+    the matching elements are formatted, as one group.
+
+    Returns:
+        int: Total number of formatted vectors
+    """
+    from corpus_store import CorpusStore
+
+    if (output_dir is None) == (index is None):
+        raise ValueError("Provide exactly one of output_dir or index.")
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    formatter = PineconeFormatter("", "", embeddings_path)
+    total = 0
+    with CorpusStore(store_path) as store:
+        if corporate is not None or year is not None:
+            groups = [(f"{corporate or 'all'}_{year or 'all'}", store.scan(corporate=corporate, year=year))]
+        else:
+            groups = [(report, store.scan(report=report)) for report in store.reports()]
+
+        for name, elements in groups:
+            ids, vectors, metadata = formatter.process_arrays(list(elements))
+            if index is not None:
+                for batch in iter_vector_batches(ids, vectors, metadata, batch_size):
+                    index.upsert(vectors=batch)
+                logging.info(f"Upserted {len(ids)} vectors from {name}")
+            else:
+                output_path = os.path.join(output_dir, f"{name}_pinecone.npz")
+                save_vectors_npz(output_path, ids, vectors, metadata)
+                logging.info(f"Formatted {len(ids)} vectors from {name}")
+            total += len(ids)
+
+    logging.info(f"Processed {total} vectors from corpus store {store_path}")
+    return total
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Convert a JSON file with text chunks and embeddings into Pinecone format, adding corporate name and report year to the metadata.")
-    parser.add_argument("--input_file", required=True, help="Path to the input JSON file")
-    parser.add_argument("--output_file", required=True, help="Path to the output JSON file in Pinecone data format")
-    
+    parser.add_argument("--input_file", help="Path to the input JSON file")
+    parser.add_argument("--output_file", help="Path to the output file in Pinecone data format (.json, or .npz for the compact binary format)")
+    parser.add_argument("--input_dir", help="Directory of merged JSON files to format in parallel")
+    parser.add_argument("--store", help="Corpus store to format instead of JSON files (writes to --output_dir or --index_name)")
+    parser.add_argument("--corporate", help="Only format this corporate from the corpus store")
+    parser.add_argument("--year", type=int, help="Only format this year from the corpus store")
+    parser.add_argument("--output_dir", help="Directory for the .npz output files (directory mode)")
+    parser.add_argument("--index_name", help="Upsert directly into this Pinecone index instead of writing files (directory mode)")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: number of CPUs)")
+    parser.add_argument("--batch_size", type=int, default=300, help="Number of vectors per upsert request (default: 300)")
+    parser.add_argument("--embeddings", help="Reduced embeddings (.npz) from quantize_embeddings.py to use instead of the embeddings in the input files")
+
     args = parser.parse_args()
-    
-    formatter = PineconeFormatter(args.input_file, args.output_file)
-    formatter.run()
\ No newline at end of file
+
+    if args.input_dir or args.store:
+        index = None
+        if args.index_name:
+            from pinecone import Pinecone
+            from pinecone_insert import load_pinecone_api_key
+            index = Pinecone(api_key=load_pinecone_api_key()).Index(args.index_name)
+        elif not args.output_dir:
+            parser.error("Directory and store mode require --output_dir or --index_name.")
+        if args.store:
+            format_store(args.store, args.output_dir, index, args.batch_size, args.embeddings,
+                         args.corporate, args.year)
+        else:
+            format_directory(args.input_dir, args.output_dir, index, args.workers, args.batch_size,
+                             args.embeddings)
+    else:
+        if not args.input_file or not args.output_file:
+            parser.error("Provide --input_file and --output_file, or --input_dir.")
+        formatter = PineconeFormatter(args.input_file, args.output_file, args.embeddings)
+        formatter.run()
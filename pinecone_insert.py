@@ -48,8 +48,13 @@ def main(input_file: str, index_name: str):
     api_key = load_pinecone_api_key()
     pc = Pinecone(api_key=api_key)
 
-    # Load the JSON file
-    vectors = load_json_file(input_file)
+    # Load the JSON file, or the compact binary file written by pinecone_formatter.py
+    if input_file.endswith(".npz"):
+        from pinecone_formatter import load_vectors_npz, iter_vector_batches
+        ids, values, metadata = load_vectors_npz(input_file)
+        vectors = [vector for batch in iter_vector_batches(ids, values, metadata) for vector in batch]
+    else:
+        vectors = load_json_file(input_file)
     logging.info(f"Loaded {len(vectors)} vectors from {input_file}")
 
     # Initialize Pinecone index
@@ -67,7 +72,7 @@ def main(input_file: str, index_name: str):
 if __name__ == "__main__":
     # Parse command-line arguments
     parser = argparse.ArgumentParser(description="Upsert JSON data into Pinecone index.")
-    parser.add_argument("--input_file", required=True, help="Path to the input JSON file")
+    parser.add_argument("--input_file", required=True, help="Path to the input JSON file (or .npz file from pinecone_formatter.py)")
     parser.add_argument("--index_name", required=True, help="Name of the Pinecone index")
     args = parser.parse_args()
 
@@ -0,0 +1,329 @@
+import os
+import json
+import argparse
+import logging
+from typing import List, Dict, Tuple, Optional
+import numpy as np
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+
+QUANTIZATION_METHODS = ["none", "int8", "pq"]
+
+
+def load_merged_embeddings(file_paths: List[str]) -> Tuple[List[str], np.ndarray, List[str]]:
+    """
+    Load element IDs, a float32 embedding matrix and the report of each element from merged JSON files.
+
+    The report is the (corporate, year) parsed from the element's filename, as used by the
+    search filters, or the input file path if the filename does not contain both.
+    """
+    from pinecone_formatter import parse_filename
+
+    ids = []
+    embeddings = []
+    reports = []
+    for file_path in file_paths:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            elements = json.load(f)
+        for element in elements:
+            if "embedding" in element and "element_id" in element:
+                ids.append(element["element_id"])
+                embeddings.append(element["embedding"])
+                corporate, year = parse_filename(element.get("metadata", {}).get("filename", ""))
+                reports.append(f"{corporate}_{year}" if corporate and year else file_path)
+    return ids, np.asarray(embeddings, dtype=np.float32), reports
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize vectors along the last axis."""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def truncate(vectors: np.ndarray, dim: Optional[int]) -> np.ndarray:
+    """
+    Matryoshka-style truncation: keep the first dim components and re-normalize.
+
+    text-embedding-3 models are trained so that prefixes of the embedding remain
+    usable embeddings on their own.
+    """
+    if dim is None or dim >= vectors.shape[-1]:
+        return vectors.astype(np.float32, copy=False)
+    return normalize(vectors[..., :dim]).astype(np.float32)
+
+
+def quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric per-dimension int8 scalar quantization. Returns (codes, scale)."""
+    scale = np.abs(vectors).max(axis=0) / 127.0
+    scale = np.where(scale > 0, scale, 1.0).astype(np.float32)
+    codes = np.clip(np.rint(vectors / scale), -127, 127).astype(np.int8)
+    return codes, scale
+
+
+def kmeans(vectors: np.ndarray, k: int, iterations: int = 20, seed: int = 0) -> np.ndarray:
+    """Plain Lloyd's k-means. Returns the (k, dim) centroids."""
+    rng = np.random.default_rng(seed)
+    k = min(k, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), size=k, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = assign_nearest(vectors, centroids)
+        # Per-cluster sums and counts in one pass per dimension instead of one mask per cluster
+        counts = np.bincount(assignments, minlength=k)
+        sums = np.stack([np.bincount(assignments, weights=vectors[:, d], minlength=k)
+                         for d in range(vectors.shape[1])], axis=1)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        # Re-seed empty clusters with random points
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            centroids[empty] = vectors[rng.integers(len(vectors), size=len(empty))]
+    return centroids
+
+
+def assign_nearest(vectors: np.ndarray, centroids: np.ndarray, chunk_size: int = 65536) -> np.ndarray:
+    """Index of the nearest centroid (squared L2) for each vector."""
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for i in range(0, len(vectors), chunk_size):
+        chunk = vectors[i:i + chunk_size]
+        distances = centroid_norms[None, :] - 2.0 * chunk @ centroids.T
+        assignments[i:i + chunk_size] = distances.argmin(axis=1)
+    return assignments
+
+
+def train_pq(vectors: np.ndarray, subvectors: int, centroids: int = 256,
+             iterations: int = 20, max_training_points: int = 100000, seed: int = 0) -> np.ndarray:
+    """
+    Train a product quantizer.
+
+    Returns:
+        np.ndarray: Codebooks of shape (subvectors, centroids, dim // subvectors)
+    """
+    dim = vectors.shape[1]
+    if dim % subvectors:
+        raise ValueError(f"Dimension {dim} is not divisible by {subvectors} subvectors.")
+    if centroids > 256:
+        raise ValueError("At most 256 centroids per subvector are supported (uint8 codes).")
+    rng = np.random.default_rng(seed)
+    if len(vectors) > max_training_points:
+        vectors = vectors[rng.choice(len(vectors), size=max_training_points, replace=False)]
+    sub_dim = dim // subvectors
+    k = min(centroids, len(vectors))
+    codebooks = np.zeros((subvectors, k, sub_dim), dtype=np.float32)
+    for m in range(subvectors):
+        codebooks[m] = kmeans(vectors[:, m * sub_dim:(m + 1) * sub_dim], k, iterations, seed + m)
+    return codebooks
+
+
+def encode_pq(vectors: np.ndarray, codebooks: np.ndarray) -> np.ndarray:
+    """Encode vectors into uint8 PQ codes of shape (n, subvectors)."""
+    subvectors, _, sub_dim = codebooks.shape
+    codes = np.empty((len(vectors), subvectors), dtype=np.uint8)
+    for m in range(subvectors):
+        codes[:, m] = assign_nearest(vectors[:, m * sub_dim:(m + 1) * sub_dim], codebooks[m])
+    return codes
+
+
+class QuantizedEmbeddings:
+    """Reduced embeddings: truncated float32, int8 scalar-quantized or product-quantized."""
+
+    def __init__(self, ids: List[str], method: str, dim: int, codes: np.ndarray,
+                 scale: Optional[np.ndarray] = None, codebooks: Optional[np.ndarray] = None):
+        """
+        Args:
+            ids: Element IDs, one per row of codes
+            method: "none" (float32), "int8" or "pq"
+            dim: Embedding dimension after truncation
+            codes: float32 vectors, int8 codes or uint8 PQ codes
+            scale: Per-dimension scale for int8
+            codebooks: PQ codebooks of shape (subvectors, centroids, dim // subvectors)
+        """
+        if method not in QUANTIZATION_METHODS:
+            raise ValueError(f"Unknown quantization method: {method}")
+        self.ids = ids
+        self.method = method
+        self.dim = dim
+        self.codes = codes
+        self.scale = scale
+        self.codebooks = codebooks
+
+    @classmethod
+    def build(cls, ids: List[str], vectors: np.ndarray, dim: Optional[int] = None,
+              method: str = "none", pq_subvectors: int = 64, pq_centroids: int = 256,
+              seed: int = 0) -> "QuantizedEmbeddings":
+        """Truncate and quantize full-precision vectors."""
+        vectors = truncate(vectors, dim)
+        dim = vectors.shape[1]
+        if method == "int8":
+            codes, scale = quantize_int8(vectors)
+            return cls(ids, method, dim, codes, scale=scale)
+        if method == "pq":
+            codebooks = train_pq(vectors, pq_subvectors, pq_centroids, seed=seed)
+            return cls(ids, method, dim, encode_pq(vectors, codebooks), codebooks=codebooks)
+        return cls(ids, method, dim, vectors)
+
+    def decode(self) -> np.ndarray:
+        """Reconstruct float32 vectors."""
+        if self.method == "int8":
+            return self.codes.astype(np.float32) * self.scale
+        if self.method == "pq":
+            return np.concatenate(
+                [self.codebooks[m][self.codes[:, m]] for m in range(self.codebooks.shape[0])], axis=1
+            )
+        return self.codes
+
+    def prepare_query(self, query: np.ndarray) -> np.ndarray:
+        """Truncate and normalize a full-dimension query embedding to match the stored vectors."""
+        return truncate(np.asarray(query, dtype=np.float32), self.dim)
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        """Dot-product scores of one query against all stored vectors."""
+        query = self.prepare_query(query)
+        if self.method == "int8":
+            return self.codes @ (query * self.scale)
+        if self.method == "pq":
+            # Asymmetric distance computation: one lookup table per subvector
+            subvectors, _, sub_dim = self.codebooks.shape
+            tables = np.einsum("mkd,md->mk", self.codebooks, query.reshape(subvectors, sub_dim))
+            return tables[np.arange(subvectors), self.codes].sum(axis=1)
+        return self.codes @ query
+
+    def nbytes(self) -> int:
+        """Memory used by the codes and quantization parameters."""
+        extra = sum(a.nbytes for a in (self.scale, self.codebooks) if a is not None)
+        return self.codes.nbytes + extra
+
+    def save(self, output_path: str):
+        """Save to a .npz file."""
+        arrays = {"ids": np.array(self.ids, dtype=str), "method": np.array(self.method),
+                  "dim": np.array(self.dim), "codes": self.codes}
+        if self.scale is not None:
+            arrays["scale"] = self.scale
+        if self.codebooks is not None:
+            arrays["codebooks"] = self.codebooks
+        np.savez(output_path, **arrays)
+
+    @classmethod
+    def load(cls, input_path: str) -> "QuantizedEmbeddings":
+        """Load from a .npz file written by save."""
+        with np.load(input_path) as data:
+            return cls(
+                data["ids"].tolist(), str(data["method"]), int(data["dim"]), data["codes"],
+                scale=data["scale"] if "scale" in data else None,
+                codebooks=data["codebooks"] if "codebooks" in data else None,
+            )
+
+
+def recall_at_k(full_vectors: np.ndarray, reduced: QuantizedEmbeddings,
+                query_vectors: np.ndarray, k: int = 20, reports: Optional[List[str]] = None) -> List[float]:
+    """
+    Recall@k of the reduced embeddings against exact full-precision search.
+
+    Searches are filtered to one report at a time, as in semantic search, so recall is
+    measured within each report's candidates and averaged over reports. Without reports,
+    all vectors are one candidate set.
+
+    Returns:
+        List[float]: Fraction of the full-precision top-k found in the reduced top-k, per query
+    """
+    if reports is None:
+        candidate_sets = [np.arange(len(full_vectors))]
+    else:
+        labels = np.asarray(reports)
+        candidate_sets = [np.flatnonzero(labels == report) for report in dict.fromkeys(reports)]
+
+    recalls = []
+    for query in query_vectors:
+        exact_scores = full_vectors @ query
+        approx_scores = reduced.scores(query)
+        report_recalls = []
+        for rows in candidate_sets:
+            report_k = min(k, len(rows))
+            exact = set(rows[np.argpartition(-exact_scores[rows], report_k - 1)[:report_k]].tolist())
+            approx = set(rows[np.argpartition(-approx_scores[rows], report_k - 1)[:report_k]].tolist())
+            report_recalls.append(len(exact & approx) / report_k)
+        recalls.append(float(np.mean(report_recalls)))
+    return recalls
+
+
+def embed_queries(queries: Dict[str, str], model: str = "text-embedding-3-small") -> np.ndarray:
+    """Embed all queries with one OpenAI API call."""
+    from openai import OpenAI
+    client = OpenAI()
+    texts = [text.replace("\n", " ") for text in queries.values()]
+    response = client.embeddings.create(input=texts, model=model)
+    return np.asarray([item.embedding for item in response.data], dtype=np.float32)
+
+
+def load_query_embeddings(file_path: str, queries: Dict[str, str]) -> np.ndarray:
+    """Load precomputed query embeddings from a JSON file mapping query name to embedding."""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        embeddings = json.load(f)
+    return np.asarray([embeddings[name] for name in queries], dtype=np.float32)
+
+
+def report_recall(full_vectors: np.ndarray, reduced: QuantizedEmbeddings,
+                  query_vectors: np.ndarray, query_names: List[str], k: int = 20,
+                  reports: Optional[List[str]] = None) -> Dict:
+    """Log and return recall@k per query, averaged over reports, and the compression ratio."""
+    recalls = recall_at_k(full_vectors, reduced, query_vectors, k, reports)
+    for name, recall in zip(query_names, recalls):
+        logging.info(f"{name}: recall@{k} = {recall:.3f}")
+    report = {
+        "method": reduced.method,
+        "dim": reduced.dim,
+        "k": k,
+        "reports": len(set(reports)) if reports is not None else 1,
+        "mean_recall": float(np.mean(recalls)) if recalls else None,
+        "recall_per_query": dict(zip(query_names, recalls)),
+        "full_bytes": int(full_vectors.nbytes),
+        "reduced_bytes": int(reduced.nbytes()),
+    }
+    logging.info(f"Mean recall@{k}: {report['mean_recall']:.3f}, "
+                 f"size {report['full_bytes']} -> {report['reduced_bytes']} bytes "
+                 f"({report['full_bytes'] / max(report['reduced_bytes'], 1):.1f}x smaller)")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Truncate and quantize merged embeddings, and report recall against full precision.")
+    parser.add_argument("--input_files", nargs='+', required=True, help="Merged JSON files with embeddings (output of merge_embedding.py).")
+    parser.add_argument("--output_file", required=True, help="Path to the output .npz file with the reduced embeddings.")
+    parser.add_argument("--dim", type=int, default=None, help="Truncate embeddings to this dimension (Matryoshka). Default: keep all dimensions.")
+    parser.add_argument("--quantization", choices=QUANTIZATION_METHODS, default="int8", help="Quantization method (default: int8).")
+    parser.add_argument("--pq_subvectors", type=int, default=64, help="Number of PQ subvectors (default: 64).")
+    parser.add_argument("--pq_centroids", type=int, default=256, help="Number of centroids per PQ subvector (default: 256).")
+    parser.add_argument("--recall_k", type=int, default=20, help="k for the recall@k report (default: 20).")
+    parser.add_argument("--query_embeddings", help="JSON file mapping TCFD query names to embeddings. If omitted, the queries are embedded with the OpenAI API.")
+    parser.add_argument("--skip_recall", action="store_true", help="Do not compute the recall report.")
+    parser.add_argument("--report_file", help="Optional path to save the recall report as JSON.")
+    args = parser.parse_args()
+
+    ids, full_vectors, reports = load_merged_embeddings(args.input_files)
+    if not ids:
+        raise ValueError("No embeddings found in the input files.")
+    logging.info(f"Loaded {len(ids)} embeddings of dimension {full_vectors.shape[1]}")
+
+    reduced = QuantizedEmbeddings.build(ids, full_vectors, args.dim, args.quantization,
+                                        args.pq_subvectors, args.pq_centroids)
+    output_dir = os.path.dirname(args.output_file)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    reduced.save(args.output_file)
+    logging.info(f"Saved {reduced.method} embeddings of dimension {reduced.dim} to {args.output_file}")
+
+    if not args.skip_recall:
+        from tcfd_queries import TCFD_QUERIES
+        if args.query_embeddings:
+            query_vectors = load_query_embeddings(args.query_embeddings, TCFD_QUERIES)
+        else:
+            query_vectors = embed_queries(TCFD_QUERIES)
+        report = report_recall(normalize(full_vectors), reduced, normalize(query_vectors),
+                               list(TCFD_QUERIES), args.recall_k, reports)
+        if args.report_file:
+            with open(args.report_file, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
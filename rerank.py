@@ -0,0 +1,213 @@
+import os
+import json
+import time
+import hashlib
+import argparse
+import logging
+from functools import lru_cache
+from typing import List, Dict, Tuple, Optional
+
+logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+
+DEFAULT_RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+
+@lru_cache(maxsize=1)
+def _get_encoding():
+    import tiktoken
+    return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens with tiktoken if available, otherwise estimate 4 characters per token."""
+    try:
+        encoding = _get_encoding()
+    except ImportError:
+        return max(1, len(text) // 4)
+    return len(encoding.encode(text))
+
+
+def pair_key(model_name: str, query: str, text: str) -> str:
+    """Content hash of a (query, chunk) pair scored by a model, used as the score cache key."""
+    return hashlib.sha256(f"{model_name}\x00{query}\x00{text}".encode("utf-8")).hexdigest()
+
+
+class Reranker:
+    """Re-rank retrieved chunks with a local cross-encoder on CPU, caching scores by content hash."""
+
+    def __init__(self, model_name: str = DEFAULT_RERANK_MODEL, cache_path: Optional[str] = None,
+                 batch_size: int = 64, device: str = "cpu"):
+        """
+        Args:
+            model_name: sentence-transformers cross-encoder model
+            cache_path: Optional JSON file to persist scores between runs
+            batch_size: Number of pairs per forward batch
+            device: Torch device for the model
+        """
+        self.model_name = model_name
+        self.cache_path = cache_path
+        self.batch_size = batch_size
+        self.device = device
+        self.model = None
+        self.cache = {}
+        # True when the cache has scores that are not written to cache_path yet
+        self.cache_dirty = False
+        if cache_path and os.path.exists(cache_path):
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                self.cache = json.load(f)
+
+    def load_model(self):
+        """Load the cross-encoder on first use."""
+        if self.model is None:
+            try:
+                from sentence_transformers import CrossEncoder
+            except ImportError:
+                raise ImportError("Reranking requires sentence-transformers: pip install sentence-transformers")
+            self.model = CrossEncoder(self.model_name, device=self.device)
+        return self.model
+
+    def score(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        """
+        Score (query, text) pairs. Uncached pairs are scored in a single predict call.
+        New scores are kept in memory until save_cache() is called.
+
+        Returns:
+            List[float]: Relevance scores aligned with pairs
+        """
+        keys = [pair_key(self.model_name, query, text) for query, text in pairs]
+        missing = {}
+        for key, pair in zip(keys, pairs):
+            if key not in self.cache and key not in missing:
+                missing[key] = pair
+        if missing:
+            scores = self.load_model().predict(list(missing.values()), batch_size=self.batch_size)
+            for key, value in zip(missing, scores):
+                self.cache[key] = float(value)
+            self.cache_dirty = True
+        return [self.cache[key] for key in keys]
+
+    def save_cache(self):
+        """Write the score cache to cache_path, if set and changed."""
+        if self.cache_path and self.cache_dirty:
+            with open(self.cache_path, 'w', encoding='utf-8') as f:
+                json.dump(self.cache, f)
+            self.cache_dirty = False
+
+    def rerank(self, query_docs: Dict[str, Tuple[str, List[Dict]]],
+               token_budget: Optional[int] = None) -> Dict[str, List[Dict]]:
+        """
+        Re-rank the documents of all queries of a report in one pass.
+
+        Args:
+            query_docs: Query name -> (query text, retrieved documents with a "text" key)
+            token_budget: Maximum tokens of the context per query; None keeps all documents
+
+        Returns:
+            Dict[str, List[Dict]]: Query name -> documents sorted by cross-encoder score and
+            trimmed to the token budget
+        """
+        pairs = [(query, doc["text"]) for query, docs in query_docs.values() for doc in docs]
+        scores = iter(self.score(pairs))
+        reranked = {}
+        for query_name, (_, docs) in query_docs.items():
+            ranked = sorted(zip(docs, scores), key=lambda x: x[1], reverse=True)
+            reranked[query_name] = trim_to_budget([doc for doc, _ in ranked], token_budget)
+        return reranked
+
+
+def trim_to_budget(docs: List[Dict], token_budget: Optional[int]) -> List[Dict]:
+    """Keep documents in order until the context would exceed token_budget (always keeps the first)."""
+    if token_budget is None:
+        return docs
+    kept = []
+    used = 0
+    for doc in docs:
+        tokens = count_tokens(str(doc))
+        if kept and used + tokens > token_budget:
+            break
+        kept.append(doc)
+        used += tokens
+    return kept
+
+
+def context_tokens(query_docs: Dict[str, List[Dict]]) -> int:
+    """Tokens of the context strings built from the documents of all queries."""
+    return sum(count_tokens("\n".join(str(doc) for doc in docs)) for docs in query_docs.values())
+
+
+def rerank_with_stats(reranker: Reranker, query_docs: Dict[str, Tuple[str, List[Dict]]],
+                      token_budget: Optional[int] = None) -> Tuple[Dict[str, List[Dict]], Dict]:
+    """Re-rank a report and measure the latency and the reduction in context size."""
+    tokens_before = context_tokens({name: docs for name, (_, docs) in query_docs.items()})
+    start = time.perf_counter()
+    reranked = reranker.rerank(query_docs, token_budget)
+    latency = time.perf_counter() - start
+    tokens_after = context_tokens(reranked)
+    stats = {
+        "latency_seconds": latency,
+        "pairs": sum(len(docs) for _, docs in query_docs.values()),
+        "tokens_before": tokens_before,
+        "tokens_after": tokens_after,
+        "reduction": 1 - tokens_after / tokens_before if tokens_before else 0.0,
+    }
+    return reranked, stats
+
+
+def benchmark(chunk_files: List[str], reranker: Reranker, token_budget: Optional[int],
+              top_k: int = 20, query_embeddings: Optional[str] = None) -> List[Dict]:
+    """
+    Benchmark reranking per report on local chunk files, without Pinecone.
+
+    Retrieves top_k chunks per TCFD query for each report with local_search.LocalIndex,
+    re-ranks them and reports the CPU latency and context reduction per report.
+    """
+    from local_search import LocalIndex
+    from quantize_embeddings import embed_queries, load_query_embeddings
+    from tcfd_queries import TCFD_QUERIES
+
+    if query_embeddings:
+        query_vectors = load_query_embeddings(query_embeddings, TCFD_QUERIES)
+    else:
+        query_vectors = embed_queries(TCFD_QUERIES)
+
+    # Load the model up front so the latency per report excludes model loading
+    reranker.load_model()
+
+    results = []
+    for chunk_file in chunk_files:
+        index = LocalIndex.from_files([chunk_file])
+        query_docs = {
+            name: (text, [{"text": doc["text"], "page_number": doc["page_number"]}
+                          for doc in index.search(vector, top_k)])
+            for (name, text), vector in zip(TCFD_QUERIES.items(), query_vectors)
+        }
+        _, stats = rerank_with_stats(reranker, query_docs, token_budget)
+        stats["report"] = chunk_file
+        logging.info(f"{chunk_file}: {stats['pairs']} pairs in {stats['latency_seconds']:.2f}s, "
+                     f"context {stats['tokens_before']} -> {stats['tokens_after']} tokens "
+                     f"({stats['reduction']:.0%} smaller)")
+        results.append(stats)
+    reranker.save_cache()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cross-encoder reranking of TCFD retrieval results on local chunk files.")
+    parser.add_argument("--chunk_files", nargs='+', required=True, help="Merged JSON files with text chunks and embeddings, one per report.")
+    parser.add_argument("--model", default=DEFAULT_RERANK_MODEL, help=f"Cross-encoder model (default: {DEFAULT_RERANK_MODEL}).")
+    parser.add_argument("--token_budget", type=int, default=None, help="Maximum context tokens per query after reranking.")
+    parser.add_argument("--top_k", type=int, default=20, help="Number of retrieved chunks per query before reranking (default: 20).")
+    parser.add_argument("--cache_file", help="JSON file to cache reranking scores.")
+    parser.add_argument("--query_embeddings", help="JSON file mapping TCFD query names to embeddings. If omitted, the queries are embedded with the OpenAI API.")
+    parser.add_argument("--output_file", help="Optional path to save the benchmark results as JSON.")
+    args = parser.parse_args()
+
+    reranker = Reranker(args.model, args.cache_file)
+    results = benchmark(args.chunk_files, reranker, args.token_budget, args.top_k, args.query_embeddings)
+    if args.output_file:
+        with open(args.output_file, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
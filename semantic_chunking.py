@@ -1,7 +1,9 @@
 import argparse
+import hashlib
+import json
 import os
 import re
-from unstructured.staging.base import elements_to_json
+from unstructured.staging.base import elements_to_json, elements_from_json
 from unstructured.partition.pdf import partition_pdf
 from unstructured.chunking.title import chunk_by_title
 import nltk
@@ -37,25 +39,56 @@ def filter_elements(elements):
     elements = [el for el in elements if el.category != "Footer"]
     return elements
 
+def partition_cache_suffix(strategy, infer_table_structure, extract_element_types, languages, hi_res_model_name):
+    """File name suffix of cached partitions, with a hash of all partitioning options."""
+    options = json.dumps([strategy, infer_table_structure, sorted(extract_element_types or []),
+                          list(languages or []), hi_res_model_name])
+    key = hashlib.sha256(options.encode("utf-8")).hexdigest()[:12]
+    return f"_{hi_res_model_name}_{key}_partition.json"
+
+def partition_cache_file(partition_cache_dir, pdf_name, strategy, infer_table_structure, extract_element_types, languages, hi_res_model_name):
+    """
+    Path of the cached, filtered partition of a PDF.
+
+    The file name includes a hash of all partitioning options, so a partition made
+    with other options is never reused.
+    """
+    file_name = os.path.splitext(os.path.basename(pdf_name))[0]
+    suffix = partition_cache_suffix(strategy, infer_table_structure, extract_element_types, languages, hi_res_model_name)
+    return os.path.join(partition_cache_dir, file_name + suffix)
+
 # Function to process a list of PDFs and save output to a directory
-def process_pdfs(pdf_names, output_dir, strategy, infer_table_structure, extract_element_types, languages, hi_res_model_name, max_characters, new_after_n_chars):
+def process_pdfs(pdf_names, output_dir, strategy, infer_table_structure, extract_element_types, languages, hi_res_model_name, max_characters, new_after_n_chars, partition_cache_dir=None):
     os.makedirs(output_dir, exist_ok=True)
+    if partition_cache_dir:
+        os.makedirs(partition_cache_dir, exist_ok=True)
 
     for pdf_name in pdf_names:
         try:
             file_name = os.path.splitext(os.path.basename(pdf_name))[0]
             output_file = os.path.join(output_dir, f"{file_name}_{hi_res_model_name}_{max_characters}char.json")
+            cache_file = partition_cache_file(
+                partition_cache_dir, pdf_name, strategy, infer_table_structure, extract_element_types,
+                languages, hi_res_model_name
+            ) if partition_cache_dir else None
+
+            if cache_file and os.path.exists(cache_file):
+                # Reuse the filtered partition, so only the chunking is repeated
+                pdf_elements = elements_from_json(filename=cache_file)
+            else:
+                pdf_elements = partition_pdf(
+                    filename=pdf_name,
+                    strategy=strategy,
+                    infer_table_structure=infer_table_structure,
+                    extract_element_types=extract_element_types,
+                    languages=languages,
+                    hi_res_model_name=hi_res_model_name
+                )
+
+                pdf_elements = filter_elements(pdf_elements)
+                if cache_file:
+                    elements_to_json(pdf_elements, filename=cache_file)
 
-            pdf_elements = partition_pdf(
-                filename=pdf_name,
-                strategy=strategy,
-                infer_table_structure=infer_table_structure,
-                extract_element_types=extract_element_types,
-                languages=languages,
-                hi_res_model_name=hi_res_model_name
-            )
-
-            pdf_elements = filter_elements(pdf_elements)
             pdf_elements = chunk_elements_by_title(pdf_elements, max_characters, new_after_n_chars)
 
             elements_to_json(pdf_elements, filename=output_file)
@@ -76,6 +109,7 @@ def main():
     parser.add_argument("--infer_table_structure", type=bool, default=True, help="Whether to infer table structure. Default is True.")
     parser.add_argument("--extract_element_types", nargs="*", default=['Table'], help="Element types to extract. Default is ['Table'].")
     parser.add_argument("--hi_res_model_name", default="yolox", help="Model name for hi_res strategy. Default is 'yolox'.")
+    parser.add_argument("--partition_cache_dir", default=None, help="Directory to cache the filtered PDF partitions, so re-chunking (e.g. with chunk_autotune.py) skips partitioning (optional).")
 
     args = parser.parse_args()
 
@@ -89,13 +123,14 @@ def main():
     infer_table_structure = args.infer_table_structure
     extract_element_types = args.extract_element_types
     hi_res_model_name = args.hi_res_model_name
+    partition_cache_dir = args.partition_cache_dir
 
     if not pdf_files:
         pdf_files = [os.path.join(pdf_dir, f) for f in os.listdir(pdf_dir) if f.lower().endswith('.pdf')]
 
     process_pdfs(
         pdf_files, output_dir, strategy, infer_table_structure, extract_element_types,
-        languages, hi_res_model_name, max_characters, new_after_n_chars
+        languages, hi_res_model_name, max_characters, new_after_n_chars, partition_cache_dir
     )
 
 if __name__ == "__main__":
@@ -1,8 +1,11 @@
 import os
 import json
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from pinecone import Pinecone
 from openai import OpenAI
+from tcfd_queries import TCFD_QUERIES
+from rerank import Reranker, rerank_with_stats, DEFAULT_RERANK_MODEL
 
 # Helper function to retrieve environment variables with error handling
 def get_env_var(var_name):
@@ -27,26 +30,132 @@ def load_pinecone_api_key() -> str:
     return api_key
 
 
-def get_embedding(text, model="text-embedding-3-small"):
+def get_embedding(text, model="text-embedding-3-small", dimensions=None):
+    """
+    Embed a query. With dimensions, the API returns a shortened, re-normalized embedding;
+    this must match the dimension of an index built from reduced embeddings.
+    """
     text = text.replace("\n", " ")
+    if dimensions:
+        return client.embeddings.create(input=[text], model=model, dimensions=dimensions).data[0].embedding
     return client.embeddings.create(input=[text], model=model).data[0].embedding
 
-def get_docs(query: str, top_k: int, corporate: str, year: int, index) -> list[str]:
-    query_embed = get_embedding(query, model='text-embedding-3-small')
-    # search pinecone index
-    res = index.query(vector=query_embed, 
-                      top_k=top_k, 
-                      include_metadata=True,
-                      # filter by metadata
-                      filter={"corporate": corporate, "year": year}) 
+# Pinecone returns at most 1,000 matches per query when metadata is included,
+# and a query response can be at most 4 MB
+PINECONE_MAX_TOP_K_WITH_METADATA = 1000
+PINECONE_MAX_RESPONSE_BYTES = 4 * 1024 * 1024
+# Generous size of one match with metadata; enriched table descriptions run to several KB
+ESTIMATED_MATCH_BYTES = 6 * 1024
+MAX_MATCHES_PER_QUERY = min(PINECONE_MAX_TOP_K_WITH_METADATA,
+                            PINECONE_MAX_RESPONSE_BYTES // ESTIMATED_MATCH_BYTES)
+# Number of Pinecone queries issued concurrently
+QUERY_WORKERS = 8
+
+
+def as_list(value) -> list:
+    """Wrap a single corporate or year into a list; pass collections through as a list."""
+    if isinstance(value, (str, int)):
+        return [value]
+    return list(value)
+
+
+def build_filter(entities: list, metadata_filter: dict = None) -> dict:
+    """
+    Build a Pinecone metadata filter for a set of (corporate, year) pairs.
+
+    If all corporates share the same years, the filter is a pair of $in conditions;
+    otherwise it is an $or over corporates, each with its own years.
+    metadata_filter can add further conditions, including range filters such as
+    {"page_number": {"$gte": 10, "$lte": 50}}.
+    """
+    years_by_corporate = {}
+    for corporate, year in entities:
+        years_by_corporate.setdefault(corporate, []).append(year)
+
+    def condition(values):
+        return values[0] if len(values) == 1 else {"$in": values}
+
+    query_filter = dict(metadata_filter or {})
+    year_sets = {tuple(years) for years in years_by_corporate.values()}
+    if len(year_sets) == 1:
+        query_filter["corporate"] = condition(list(years_by_corporate))
+        query_filter["year"] = condition(list(year_sets.pop()))
+    else:
+        query_filter["$or"] = [{"corporate": corporate, "year": condition(years)}
+                               for corporate, years in years_by_corporate.items()]
+    return query_filter
+
+
+def group_entities(entities: list, top_k: int) -> list:
+    """Split entities into groups whose top_k results fit into a single query."""
+    group_size = max(1, MAX_MATCHES_PER_QUERY // top_k)
+    return [entities[i:i + group_size] for i in range(0, len(entities), group_size)]
+
+
+def get_docs_by_entity(query: str, top_k: int, corporates, years, index,
+                       metadata_filter: dict = None, query_embed: list = None, dimensions: int = None) -> dict:
+    """
+    Retrieve the top_k documents for every (corporate, year) pair with as few filtered queries as possible.
+
+    Entities are packed into groups whose combined results stay within Pinecone's
+    limits for queries with metadata, and each group is sent as one query. A group
+    query can be dominated by a few entities; entities that end up with fewer than
+    top_k documents although their query came back full are then queried one by one,
+    concurrently, keeping the documents they already have. This guarantees top_k
+    documents per entity whenever the index holds that many, with at most one extra
+    round of queries.
+
+    dimensions sets the embedding size of the query, for indexes built from reduced
+    embeddings (quantize_embeddings.py --dim).
+
+    Returns:
+        dict: (corporate, year) -> list of documents, best first
+    """
+    if query_embed is None:
+        query_embed = get_embedding(query, model='text-embedding-3-small', dimensions=dimensions)
+    # a single query cannot return more than MAX_MATCHES_PER_QUERY documents for one entity
+    top_k = min(top_k, MAX_MATCHES_PER_QUERY)
+
+    entities = [(corporate, year) for corporate in as_list(corporates) for year in as_list(years)]
+    grouped = {entity: [] for entity in entities}
+    seen = {entity: set() for entity in entities}
 
-    # extract metadata: text and page number
-    docs = [{"text": x["metadata"]['text'], "page_number": x["metadata"].get('page_number', 'N/A')}
-            for x in res["matches"]]
+    def query_group(group):
+        """Query one group and return True if the response was full (more matches may exist)."""
+        requested = min(top_k * len(group), MAX_MATCHES_PER_QUERY)
+        res = index.query(vector=query_embed,
+                          top_k=requested,
+                          include_metadata=True,
+                          # filter by metadata
+                          filter=build_filter(group, metadata_filter))
+        for x in res["matches"]:
+            entity = (x["metadata"].get("corporate"), int(x["metadata"].get("year", 0)))
+            if entity in grouped and len(grouped[entity]) < top_k and x["id"] not in seen[entity]:
+                seen[entity].add(x["id"])
+                # extract metadata: text and page number
+                grouped[entity].append({"text": x["metadata"]['text'],
+                                        "page_number": x["metadata"].get('page_number', 'N/A')})
+        return len(res["matches"]) >= requested
 
-    return docs
+    groups = group_entities(entities, top_k)
+    # Queries of different groups and entities update disjoint entries of grouped and seen
+    with ThreadPoolExecutor(max_workers=QUERY_WORKERS) as executor:
+        full = list(executor.map(query_group, groups))
+        # only entities that are short after a full response can have more matches
+        crowded_out = [entity for group, is_full in zip(groups, full) if is_full
+                       for entity in group if len(grouped[entity]) < top_k]
+        list(executor.map(lambda entity: query_group([entity]), crowded_out))
 
-def extract_and_save_context(tcfd_queries, corporate, year, output_file, index):
+    return grouped
+
+def get_docs(query: str, top_k: int, corporate: str, year: int, index, metadata_filter: dict = None,
+             dimensions: int = None) -> list:
+    """Retrieve the top_k documents for one corporate and year. Use get_docs_by_entity for several."""
+    return get_docs_by_entity(query, top_k, [corporate], [year], index, metadata_filter,
+                              dimensions=dimensions)[(corporate, year)]
+
+def extract_and_save_context(tcfd_queries, corporate, year, output_file, index, metadata_filter=None,
+                             reranker=None, token_budget=None, dimensions=None):
     """
     Iterate through a list of queries, retrieve documents, and save the extracted context to a JSON file.
     Append the results to the file if it already exists.
@@ -58,43 +167,92 @@ def extract_and_save_context(tcfd_queries, corporate, year, output_file, index):
         year (int): The year for the retrieval.
         output_file (str): The filename for the output JSON file.
         index: The Pinecone index object.
+        metadata_filter (dict): Optional additional Pinecone metadata filter.
+        reranker (rerank.Reranker): Optional cross-encoder to re-rank the retrieved documents.
+        token_budget (int): Maximum context tokens per query after reranking.
+        dimensions (int): Query embedding size, for an index of reduced embeddings.
 
     Returns:
         None
     """
-    # Initialize a dictionary to store all data
-    corporate_year_data = {}
+    extract_and_save_contexts(tcfd_queries, [corporate], [year], output_file, index, metadata_filter,
+                              reranker, token_budget, dimensions)
 
-    # Key for all contexts combined for a specific corporate and year
-    combined_key = f"{corporate}_{year}"
-    combined_context = ""
+def extract_and_save_contexts(tcfd_queries, corporates, years, output_file, index, metadata_filter=None,
+                              reranker=None, token_budget=None, dimensions=None):
+    """
+    Retrieve and save the context for every combination of corporates and years.
+
+    Each query is embedded once and issued as filtered queries over groups of entities;
+    the results are grouped per entity afterwards.
 
-    # Initialize a dictionary for the all_data section
-    all_data = {}
+    Parameters:
+        tcfd_queries (dict): Dictionary where keys are query names (e.g., "tcfd_01")
+                             and values are the corresponding query strings.
+        corporates (list): The corporate entities for the retrieval.
+        years (list): The years for the retrieval.
+        output_file (str): The filename for the output JSON file.
+        index: The Pinecone index object.
+        metadata_filter (dict): Optional additional Pinecone metadata filter.
+        reranker (rerank.Reranker): Optional cross-encoder to re-rank the retrieved documents.
+                                    All queries of an entity are re-ranked in one pass.
+        token_budget (int): Maximum context tokens per query after reranking.
+        dimensions (int): Query embedding size, for an index of reduced embeddings.
+
+    Returns:
+        None
+    """
+    entities = [(corporate, year) for corporate in corporates for year in years]
+
+    # Retrieved documents of each entity: query name -> (query text, documents)
+    query_docs = {entity: {} for entity in entities}
 
     # Iterate through each query in the dictionary
     for query_name, query_text in tcfd_queries.items():
-        # Call the get_docs function to retrieve documents for the query
-        docs = get_docs(query_text, top_k=20, corporate=corporate, year=year, index=index)
-        
-        if not docs:
-            print(f"No matches found for corporate: {corporate}, year: {year}")
-            continue
-        
-        # Generate the context by joining all retrieved documents
-        context = "\n".join(str(doc) for doc in docs)
+        # Retrieve documents for all entities with shared filtered queries
+        grouped_docs = get_docs_by_entity(query_text, top_k=20, corporates=corporates, years=years,
+                                          index=index, metadata_filter=metadata_filter,
+                                          dimensions=dimensions)
+
+        for (corporate, year), docs in grouped_docs.items():
+            if not docs:
+                print(f"No matches found for corporate: {corporate}, year: {year}")
+                continue
+            query_docs[(corporate, year)][query_name] = (query_text, docs)
+
+    # Initialize a dictionary for the all_data section of each entity
+    all_data = {entity: {} for entity in entities}
+    combined_context = {entity: "" for entity in entities}
+
+    for (corporate, year), entity_docs in query_docs.items():
+        if reranker is not None and entity_docs:
+            ranked_docs, stats = rerank_with_stats(reranker, entity_docs, token_budget)
+            print(f"Reranked {stats['pairs']} documents for {corporate} {year} in {stats['latency_seconds']:.2f}s, "
+                  f"context {stats['tokens_before']} -> {stats['tokens_after']} tokens")
+        else:
+            ranked_docs = {query_name: docs for query_name, (_, docs) in entity_docs.items()}
 
-        # Add the context to the dictionary with the query name as the key
-        all_data[query_name] = context
+        for query_name, docs in ranked_docs.items():
+            # Generate the context by joining all retrieved documents
+            context = "\n".join(str(doc) for doc in docs)
 
-        # Append the context to the combined context
-        combined_context += context + "\n"
+            # Add the context to the dictionary with the query name as the key
+            all_data[(corporate, year)][query_name] = context
 
-    # Add the combined context to the all_data dictionary
-    all_data[combined_key] = combined_context
+            # Append the context to the combined context
+            combined_context[(corporate, year)] += context + "\n"
 
-    # Wrap the entire data under the corporate_year_data dictionary
-    corporate_year_data[combined_key] = all_data
+    # Write the scores of all entities to the rerank cache once
+    if reranker is not None:
+        reranker.save_cache()
+
+    # Key for all contexts combined for a specific corporate and year,
+    # wrapped under the corporate_year_data dictionary
+    corporate_year_data = {}
+    for corporate, year in entities:
+        combined_key = f"{corporate}_{year}"
+        all_data[(corporate, year)][combined_key] = combined_context[(corporate, year)]
+        corporate_year_data[combined_key] = all_data[(corporate, year)]
 
     # Check if the output file already exists
     if os.path.exists(output_file):
@@ -116,33 +274,35 @@ def main():
     parser = argparse.ArgumentParser(description="Perform semantic search on Pinecone database and save the output.")
     parser.add_argument("--index_name", type=str, required=True, help="Name of the Pinecone index")
     parser.add_argument("--corporates", type=str, nargs='+', required=True, help="List of corporate names")
-    parser.add_argument("--years", type=int, nargs='+', required=True, help="List of years")
+    parser.add_argument("--years", type=int, nargs='+', help="List of years")
+    parser.add_argument("--year_range", type=int, nargs=2, metavar=("START", "END"), help="Inclusive range of years, instead of --years")
+    parser.add_argument("--metadata_filter", type=json.loads, default=None, help='Additional Pinecone metadata filter as JSON, e.g. \'{"page_number": {"$lte": 100}}\'')
     parser.add_argument("--output_file", type=str, required=True, help="Path to the output JSON file")
+    parser.add_argument("--rerank", action="store_true", help="Re-rank retrieved documents with a local cross-encoder")
+    parser.add_argument("--rerank_model", type=str, default=DEFAULT_RERANK_MODEL, help="Cross-encoder model for reranking")
+    parser.add_argument("--rerank_cache", type=str, default=None, help="JSON file to cache reranking scores")
+    parser.add_argument("--token_budget", type=int, default=None, help="Maximum context tokens per query after reranking (requires --rerank)")
+    parser.add_argument("--dimensions", type=int, default=None, help="Query embedding size; must match the index dimension when it was built from reduced embeddings (quantize_embeddings.py --dim)")
 
     args = parser.parse_args()
 
+    if args.year_range:
+        years = list(range(args.year_range[0], args.year_range[1] + 1))
+    elif args.years:
+        years = args.years
+    else:
+        parser.error("Provide --years or --year_range.")
+    if args.token_budget is not None and not args.rerank:
+        parser.error("--token_budget requires --rerank.")
+
     # Initialize Pinecone index
     index = pc.Index(args.index_name)
 
-    # Define TCFD queries
-    tcfd_queries = {
-        "tcfd_01": "How does the company’s board oversee climate-related risks and opportunities?",
-        "tcfd_02": "What is the role of management in assessing and managing climate-related risks and opportunities?",
-        "tcfd_03": "What are the most relevant climate-related risks and opportunities that the organization has identified over the short, medium, and long term? Are risks clearly associated with a horizon?",
-        "tcfd_04": "How do climate-related risks and opportunities impact the organization’s business strategy, economic and financial performance, and financial planning?",
-        "tcfd_05": "How resilient is the organization’s strategy when considering different climate-related scenarios, including a 2°C target or lower scenario? How resilient is the organization’s strategy when considering climate physical risks?",
-        "tcfd_06": "What processes does the organization use to identify and assess climate-related risks?",
-        "tcfd_07": "How does the organization manage climate-related risks?",
-        "tcfd_08": "How are the processes for identifying, assessing, and managing climate-related risks integrated into the organization’s overall risk management?",
-        "tcfd_09": "What metrics does the organization use to assess climaterelated risks and opportunities? How do these metrics help ensure that performance aligns with its strategy and risk management process?",
-        "tcfd_10": "Does the organization disclose its Scope 1, Scope 2, and, if appropriate, Scope 3 greenhouse gas (GHG) emissions? What are the related risks, and do they differ depending on the scope?",
-        "tcfd_11": "What targets does the organization use to understand, quantify, and benchmark climate-related risks and opportunities? How is the organization performing against these targets?"
-    }
-
-    # Iterate through each corporate and year combination
-    for corporate in args.corporates:
-        for year in args.years:
-            extract_and_save_context(tcfd_queries, corporate, year, args.output_file, index)
+    reranker = Reranker(args.rerank_model, args.rerank_cache) if args.rerank else None
+
+    # Retrieve all corporate and year combinations with shared filtered queries per TCFD question
+    extract_and_save_contexts(TCFD_QUERIES, args.corporates, years, args.output_file, index,
+                              args.metadata_filter, reranker, args.token_budget, args.dimensions)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,14 @@
+# TCFD recommended disclosure questions used as retrieval queries
+TCFD_QUERIES = {
+    "tcfd_01": "How does the company’s board oversee climate-related risks and opportunities?",
+    "tcfd_02": "What is the role of management in assessing and managing climate-related risks and opportunities?",
+    "tcfd_03": "What are the most relevant climate-related risks and opportunities that the organization has identified over the short, medium, and long term? Are risks clearly associated with a horizon?",
+    "tcfd_04": "How do climate-related risks and opportunities impact the organization’s business strategy, economic and financial performance, and financial planning?",
+    "tcfd_05": "How resilient is the organization’s strategy when considering different climate-related scenarios, including a 2°C target or lower scenario? How resilient is the organization’s strategy when considering climate physical risks?",
+    "tcfd_06": "What processes does the organization use to identify and assess climate-related risks?",
+    "tcfd_07": "How does the organization manage climate-related risks?",
+    "tcfd_08": "How are the processes for identifying, assessing, and managing climate-related risks integrated into the organization’s overall risk management?",
+    "tcfd_09": "What metrics does the organization use to assess climaterelated risks and opportunities? How do these metrics help ensure that performance aligns with its strategy and risk management process?",
+    "tcfd_10": "Does the organization disclose its Scope 1, Scope 2, and, if appropriate, Scope 3 greenhouse gas (GHG) emissions? What are the related risks, and do they differ depending on the scope?",
+    "tcfd_11": "What targets does the organization use to understand, quantify, and benchmark climate-related risks and opportunities? How is the organization performing against these targets?"
+}